@@ -1,10 +1,14 @@
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
+import numpy as np
 from datetime import datetime, timedelta
-from utils.firebase_handler import FirebaseHandler
-from utils.auth import check_password, logout
-from utils.ml_predictor import HealthPredictor
+from utils.storage import create_storage, _secrets_section
+from utils import perf
+from utils.rolling_stats import window_stats
+from utils.auth import check_password, logout, current_user_id, with_password, invalidate_verifier
+
+# plotly (utils.chart) と utils.ml_predictor (Google API クライアント) は
+# 読み込みが重いため、使うページで初めて import する
 
 # ページ設定
 st.set_page_config(
@@ -36,16 +40,23 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 認証チェック
+# キャッシュから追い出された保存先のリスナーを止める
+def release_storage(storage):
+    if storage.is_listening():
+        storage.stop_listening()
+
+# Firebase初期化 (secrets の storage.backend で SQLite にも切り替え可能)
+# 複数ユーザーの構成ではログイン中のユーザーごとに1つ作成して共有する
+@st.cache_resource(max_entries=1000, on_release=release_storage)
+def init_firebase(user_id=None):
+    return create_storage(user_id)
+
+# 認証チェック (ログイン前に入力された ID ごとに保存先をキャッシュしたり
+# リスナーを開いたりしないよう、照合はリスナーなしの保存先で行う)
 if not check_password():
     st.stop()
 
-# Firebase初期化
-@st.cache_resource
-def init_firebase():
-    return FirebaseHandler()
-
-fb = init_firebase()
+fb = init_firebase(current_user_id())
 
 # ジムの称号を取得
 def get_gym_title(consecutive_days):
@@ -66,14 +77,18 @@ def get_gym_title(consecutive_days):
     return "ジム未経験者"
 
 # メイン画面
+# 表示期間と読み込む日数
+PERIOD_DAYS = {"週": 7, "月": 30, "年": 365}
+
+# 予測区間のバックテストに渡す日数 (予測に使う30日 + 7日先の組が80組ほど取れる長さ)
+FORECAST_HISTORY_DAYS = 120
+
 def main_page():
     st.markdown('<div class="main-title">💪 健康管理アプリ</div>', unsafe_allow_html=True)
     
-    # データ読み込み
-    weight_df = fb.get_weight_data()
-    gym_df = fb.get_gym_data()
-    calorie_df = fb.get_calorie_data()
-    settings = fb.get_user_settings()
+    today = datetime.now().date()
+    weight_days = fb.get_weight_history_days()
+    rolling_stats = fb.get_rolling_stats()
     
     # 連続日数と称号
     consecutive_days = fb.calculate_consecutive_gym_days()
@@ -84,180 +99,163 @@ def main_page():
         unsafe_allow_html=True
     )
     
-    # AI提案
-    if len(weight_df) >= 30:
-        with st.expander("🤖 今日のAIアドバイス", expanded=True):
-            predictor = HealthPredictor(weight_df, gym_df, calorie_df)
-            result = predictor.get_daily_advice()
-            
-            st.markdown(result['advice'])
-            
-            if result['recipes']:
-                st.markdown("---")
-                st.markdown(f"### 🍽️ おすすめレシピ ({result['recipes']['category']})")
-                
-                for recipe in result['recipes']['recipes']:
-                    with st.container():
-                        col1, col2 = st.columns([3, 1])
-                        with col1:
-                            st.markdown(f"**[{recipe['title']}]({recipe['url']})**")
-                            st.caption(recipe['snippet'])
-                        with col2:
-                            st.caption(f"📍 {recipe['source']}")
-                        st.markdown("---")
-    else:
-        days_left = 30 - len(weight_df)
+    # 表示期間の変更は period_section だけを再実行し、アドバイスや称号は計算し直さない
+    advice = advice_section(today, weight_days, rolling_stats)
+    period_section(today, rolling_stats)
+    
+    # レシピ検索の結果 (時間切れの場合はフォールバック) を表示
+    if advice is not None:
+        predictor, result, recipe_slot = advice
+        recipes = predictor.wait_for_recipes(result)
+        if recipes:
+            with recipe_slot.container():
+                render_recipes(recipes)
+    
+    # リスナーで他の端末の書き込みを受け取ったら、再読み込みせずに表示を更新
+    if fb.is_listening():
+        refresh_on_update(fb.data_version())
+
+# AI提案 (レシピは検索を待たずに枠だけ確保し、ページ末尾で埋める)
+@st.fragment
+def advice_section(today, weight_days, rolling_stats):
+    if weight_days < 30:
+        days_left = 30 - weight_days
         st.info(f"📊 AIアドバイスまであと**{days_left}日**です。毎日記録を続けましょう!")
+        return None
+    
+    with st.expander("🤖 今日のAIアドバイス", expanded=True):
+        from utils.ml_predictor import HealthPredictor
+        
+        # アドバイスはサマリーから計算するので、表示期間によらず予測区間に必要な日数だけ渡す
+        # (データが変わらない間はアドバイス・予測を計算し直さない)
+        daily_df = fb.get_daily_frame(start_date=today - timedelta(days=FORECAST_HISTORY_DAYS))
+        predictor = HealthPredictor(daily_df, history_days=weight_days,
+                                    trend=fb.get_weight_trend(), rolling_stats=rolling_stats,
+                                    data_key=fb.data_key())
+        result = predictor.get_daily_advice()
+        
+        st.markdown(result['advice'])
+        render_weight_forecast(predictor.predict_weight_interval())
+        return predictor, result, st.empty()
+
+# 1週間後の体重予測 (バックテストで選んだモデルと80%予測区間)
+def render_weight_forecast(interval):
+    if interval is None:
+        return
     
-    # 期間選択
+    last = interval['forecast'].iloc[-1]
+    st.markdown(
+        f"📈 **{last['date']:%m/%d} の予測体重**: {last['prediction']:.1f} kg "
+        f"(80%の確率で {last['lower']:.1f}〜{last['upper']:.1f} kg)"
+    )
+
+# 期間選択・メトリクス・グラフ
+@st.fragment
+def period_section(today, rolling_stats):
     col1, col2, col3 = st.columns(3)
     with col1:
-        period = st.selectbox("表示期間", ["週", "月", "年"], key="period_select")
-    
-    # 期間に応じたデータフィルタリング
-    today = datetime.now().date()
-    if period == "週":
-        start_date = today - timedelta(days=7)
-    elif period == "月":
-        start_date = today - timedelta(days=30)
-    else:
-        start_date = today - timedelta(days=365)
-    
-    filtered_weight = weight_df[weight_df['date'] >= pd.Timestamp(start_date)]
-    filtered_gym = gym_df[gym_df['date'] >= pd.Timestamp(start_date)]
-    filtered_calorie = calorie_df[calorie_df['date'] >= pd.Timestamp(start_date)]
+        period = st.selectbox("表示期間", list(PERIOD_DAYS), key="period_select")
+    start_date = today - timedelta(days=PERIOD_DAYS[period])
+    settings = fb.get_user_settings()
     
-    # メトリクス表示
+    # メトリクス表示 (書き込み時に集計済みのサマリーから計算)
+    stats = window_stats(rolling_stats, (today - start_date).days + 1, today)
+    current_weight = stats['current_weight']
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        if not filtered_weight.empty:
-            current_weight = filtered_weight.iloc[-1]['weight']
-            weight_change = current_weight - filtered_weight.iloc[0]['weight']
-            st.metric("現在の体重", f"{current_weight:.1f} kg", f"{weight_change:+.1f} kg")
+        if current_weight is not None:
+            st.metric("現在の体重", f"{current_weight:.1f} kg", f"{stats['weight_change']:+.1f} kg")
         else:
             st.metric("現在の体重", "-- kg")
     
     with col2:
         weight_goal = settings.get('weight_goal', 70.0)
-        if not filtered_weight.empty:
+        if current_weight is not None:
             diff = current_weight - weight_goal
             st.metric("目標体重", f"{weight_goal:.1f} kg", f"{diff:+.1f} kg")
         else:
             st.metric("目標体重", f"{weight_goal:.1f} kg")
     
     with col3:
-        gym_count = filtered_gym['went_to_gym'].sum() if not filtered_gym.empty else 0
-        st.metric("ジム回数", f"{gym_count}回")
+        st.metric("ジム回数", f"{stats['gym_count']}回")
     
     with col4:
-        avg_calories = filtered_calorie['calories'].mean() if not filtered_calorie.empty else 0
         calorie_goal = settings.get('calorie_goal', 2000)
-        st.metric("平均消費カロリー", f"{avg_calories:.0f} kcal", f"目標: {calorie_goal} kcal")
+        st.metric("平均消費カロリー", f"{stats['avg_calories']:.0f} kcal", f"目標: {calorie_goal} kcal")
     
-    # グラフ表示
-    if not filtered_weight.empty:
-        fig = go.Figure()
-        
-        # 体重ライン
-        fig.add_trace(go.Scatter(
-            x=filtered_weight['date'],
-            y=filtered_weight['weight'],
-            mode='lines+markers',
-            name='体重',
-            line=dict(color='#1f77b4', width=3),
-            marker=dict(size=8),
-            hovertemplate='<b>日付</b>: %{x|%Y-%m-%d}<br><b>体重</b>: %{y:.1f} kg<extra></extra>'
-        ))
-        
-        # 目標体重ライン
-        fig.add_trace(go.Scatter(
-            x=filtered_weight['date'],
-            y=[weight_goal] * len(filtered_weight),
-            mode='lines',
-            name='目標体重',
-            line=dict(color='red', width=2, dash='dash'),
-            hovertemplate='<b>目標</b>: %{y:.1f} kg<extra></extra>'
-        ))
-        
-        # ジムに行った日をマーク
-        if not filtered_gym.empty:
-            gym_dates = filtered_gym[filtered_gym['went_to_gym'] == True]['date']
-            gym_weights = []
-            
-            for date in gym_dates:
-                weight_on_date = filtered_weight[filtered_weight['date'] == date]
-                if not weight_on_date.empty:
-                    gym_weights.append(weight_on_date.iloc[0]['weight'])
-                else:
-                    gym_weights.append(None)
-            
-            fig.add_trace(go.Scatter(
-                x=gym_dates,
-                y=gym_weights,
-                mode='markers',
-                name='ジム',
-                marker=dict(
-                    size=15,
-                    color='green',
-                    symbol='star',
-                    line=dict(color='darkgreen', width=2)
-                ),
-                hovertemplate='<b>ジムに行った日</b><br>%{x|%Y-%m-%d}<extra></extra>'
-            ))
-        
-        fig.update_layout(
-            title=dict(
-                text="体重推移グラフ",
-                font=dict(size=24, color='#1f77b4')
-            ),
-            xaxis_title="日付",
-            yaxis_title="体重 (kg)",
-            hovermode="x unified",
-            height=500,
-            showlegend=True,
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            )
-        )
-        
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # データテーブル
-        with st.expander("📊 詳細データを表示"):
-            merged_data = filtered_weight.copy()
-            merged_data['date_str'] = merged_data['date'].dt.strftime('%Y-%m-%d')
-            
-            if not filtered_gym.empty:
-                gym_dict = dict(zip(
-                    filtered_gym['date'].dt.strftime('%Y-%m-%d'),
-                    filtered_gym['went_to_gym']
-                ))
-                merged_data['ジム'] = merged_data['date_str'].map(gym_dict).fillna(False)
-                merged_data['ジム'] = merged_data['ジム'].map({True: '✅', False: '❌'})
-            else:
-                merged_data['ジム'] = '❌'
-            
-            if not filtered_calorie.empty:
-                calorie_dict = dict(zip(
-                    filtered_calorie['date'].dt.strftime('%Y-%m-%d'),
-                    filtered_calorie['calories']
-                ))
-                merged_data['消費カロリー'] = merged_data['date_str'].map(calorie_dict).fillna(0)
-            else:
-                merged_data['消費カロリー'] = 0
-            
-            display_df = merged_data[['date_str', 'weight', 'ジム', '消費カロリー']].copy()
-            display_df.columns = ['日付', '体重 (kg)', 'ジム', '消費カロリー (kcal)']
-            display_df = display_df.sort_values('日付', ascending=False)
-            
-            st.dataframe(display_df, use_container_width=True, hide_index=True)
-    else:
+    # グラフ表示 (同じ期間・データの版では作成済みの図と表を使い回す)
+    view = period_view(fb, fb.data_key(), period, today, weight_goal)
+    if view is None:
         st.info("📝 データがまだありません。データ入力画面から記録を始めましょう!")
+        return
+    
+    fig, display_df = view
+    with perf.timed('chart.render', period=period):
+        st.plotly_chart(fig, use_container_width=True)
+    
+    details_section(display_df)
+
+# データテーブル
+@st.fragment
+def details_section(display_df):
+    with st.expander("📊 詳細データを表示"):
+        st.dataframe(display_df, use_container_width=True, hide_index=True)
+
+# 表示期間のグラフと詳細データ
+# data_key は書き込みのたびに変わるため、古い図が残るのは他の端末の書き込みだけ
+# (クエリのキャッシュと同じ5分で作り直す)。
+# 全セッションで共有するため、呼び出しごとにコピーを返す cache_data を使う
+@st.cache_data(ttl=300, max_entries=64)
+def period_view(_fb, data_key, period, today, weight_goal):
+    from utils.chart import build_weight_figure
+    
+    start_date = today - timedelta(days=PERIOD_DAYS[period])
+    filtered_daily = _fb.get_daily_frame(start_date=start_date)
+    filtered_weight = filtered_daily['weight'].dropna()
+    if filtered_weight.empty:
+        return None
+    
+    # 長期間でも送る点数が増えないよう間引いて描画
+    gym_days = filtered_daily.loc[filtered_daily['went_to_gym'].fillna(False), 'weight']
+    with perf.timed('chart.build', period=period):
+        fig = build_weight_figure(filtered_weight, gym_days, weight_goal)
+    
+    merged_data = filtered_daily[filtered_daily['weight'].notna()].sort_index(ascending=False)
+    display_df = pd.DataFrame({
+        '日付': merged_data.index.strftime('%Y-%m-%d'),
+        '体重 (kg)': merged_data['weight'].values,
+        'ジム': np.where(merged_data['went_to_gym'].fillna(False), '✅', '❌'),
+        '消費カロリー (kcal)': merged_data['calories'].fillna(0).values
+    })
+    return fig, display_df
+
+# メモリ上のコピーの更新を確認する間隔 (秒、Firestore は読まない)
+REFRESH_SECONDS = 5
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def refresh_on_update(version):
+    if fb.data_version() != version:
+        st.rerun()
+
+# おすすめレシピ
+def render_recipes(recipes):
+    st.markdown("---")
+    st.markdown(f"### 🍽️ おすすめレシピ ({recipes['category']})")
+    
+    # 検索スレッドで起きたエラーはここ (スクリプトスレッド) で表示する
+    if recipes.get('error'):
+        st.warning(recipes['error'])
+    
+    for recipe in recipes['recipes']:
+        with st.container():
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.markdown(f"**[{recipe['title']}]({recipe['url']})**")
+                st.caption(recipe['snippet'])
+            with col2:
+                st.caption(f"📍 {recipe['source']}")
+            st.markdown("---")
 
 # データ入力画面
 def input_page():
@@ -278,9 +276,10 @@ def input_page():
         return
     
     # 既存データの読み込み
-    weight_df = fb.get_weight_data()
-    gym_df = fb.get_gym_data()
-    calorie_df = fb.get_calorie_data()
+    data = fb.load_all(include_settings=False)
+    weight_df = data['weight']
+    gym_df = data['gym']
+    calorie_df = data['calories']
     
     # 今日のデータがあれば表示
     today_weight = weight_df[weight_df['date'] == pd.Timestamp(today)]
@@ -329,16 +328,39 @@ def input_page():
         if st.button("💾 保存", type="primary", use_container_width=True):
             if weight > 0:
                 try:
-                    fb.save_weight(today, weight)
-                    fb.save_gym_record(today, went_to_gym)
-                    fb.save_calorie_record(today, calories)
-                    st.success("✅ データを保存しました!")
-                    st.balloons()
+                    # 1回のバッチコミットでまとめて保存 (バックグラウンドで反映)
+                    fb.save_daily_record(
+                        today,
+                        weight=weight,
+                        went_to_gym=went_to_gym,
+                        calories=calories,
+                        background=True
+                    )
+                    # コミットを確認してから成功を表示 (失敗した記録はキューに残って再試行される)
+                    if fb.flush_writes(timeout=SAVE_TIMEOUT):
+                        st.success("✅ データを保存しました!")
+                        st.balloons()
+                    else:
+                        render_write_status()
                 except Exception as e:
                     st.error(f"❌ エラーが発生しました: {str(e)}")
             else:
                 st.warning("⚠️ 体重を入力してください")
 
+# 保存の完了を待つ秒数 (過ぎた分はバックグラウンドで保存を続ける)
+SAVE_TIMEOUT = 20
+
+# バックグラウンド保存の状態
+def render_write_status():
+    pending = fb.pending_writes()
+    if not pending:
+        return
+    error = fb.write_error()
+    if error is not None:
+        st.error(f"❌ {pending}件の保存に失敗しました。自動で再試行しています: {error}")
+    else:
+        st.info(f"⏳ {pending}件を保存しています…")
+
 # 設定画面
 def settings_page():
     st.title("⚙️ 設定")
@@ -383,16 +405,47 @@ def settings_page():
     with col2:
         if st.button("💾 設定を保存", type="primary", use_container_width=True):
             try:
-                new_settings = {
-                    'weight_goal': weight_goal,
-                    'calorie_goal': calorie_goal,
-                    'password': new_password if new_password else settings.get('password', 'yasu0122')
-                }
+                new_settings = dict(settings, weight_goal=weight_goal, calorie_goal=calorie_goal)
+                if new_password:
+                    # ハッシュだけを保存し、発行済みのログイントークンを無効にする
+                    new_settings = with_password(new_settings, new_password)
                 fb.update_user_settings(new_settings)
+                if new_password:
+                    invalidate_verifier(current_user_id())
                 st.success("✅ 設定を保存しました!")
             except Exception as e:
                 st.error(f"❌ エラーが発生しました: {str(e)}")
 
+# パフォーマンス計測の表示
+def render_perf_panel(recorder):
+    with st.expander("⏱️ パフォーマンス"):
+        totals = recorder.totals()
+        latency = perf.render_latency()
+        
+        col1, col2 = st.columns(2)
+        col1.metric("今回の描画", f"{recorder.total_ms:.0f} ms")
+        col2.metric("p95 (直近)", f"{latency[0.95]:.0f} ms")
+        st.caption(
+            f"Firestore 読み込み: {int(totals.get('docs', 0))} 件 / "
+            f"{totals.get('bytes', 0) / 1024:.1f} KB"
+        )
+        
+        rows = recorder.summary()
+        if rows:
+            st.dataframe(pd.DataFrame({
+                '処理': [row['name'] for row in rows],
+                'ラベル': [', '.join(f'{k}={v}' for k, v in row['labels'].items()) for row in rows],
+                '回数': [row['count'] for row in rows],
+                '合計 (ms)': [round(row['total_ms'], 1) for row in rows],
+                '最大 (ms)': [round(row['max_ms'], 1) for row in rows],
+                '件数': [int(row.get('docs', 0)) for row in rows]
+            }), use_container_width=True, hide_index=True)
+        
+        st.download_button("JSON Lines", perf.to_jsonl(), file_name="perf.jsonl",
+                           use_container_width=True)
+        st.download_button("Prometheus", perf.to_prometheus(), file_name="metrics.prom",
+                           use_container_width=True)
+
 # メイン処理
 def main():
     # サイドバーでページ選択
@@ -408,13 +461,27 @@ def main():
         
         if st.button("🚪 ログアウト", use_container_width=True):
             logout()
-    
-    if page == "メイン画面":
-        main_page()
-    elif page == "データ入力":
-        input_page()
-    elif page == "設定":
-        settings_page()
+        
+        # 未コミットの保存が残っていればどのページでも表示
+        render_write_status()
+    
+    # 再実行ごとの計測 (secrets の debug.perf_panel でサイドバーに表示、
+    # debug.perf_log を指定するとそのファイルに JSON Lines で追記)
+    with perf.run(page) as recorder:
+        if page == "メイン画面":
+            main_page()
+        elif page == "データ入力":
+            input_page()
+        elif page == "設定":
+            settings_page()
+    
+    debug = _secrets_section('debug')
+    if debug.get('perf_log'):
+        with open(debug['perf_log'], 'a', encoding='utf-8') as f:
+            f.write(perf.to_jsonl([recorder]))
+    if debug.get('perf_panel'):
+        with st.sidebar:
+            render_perf_panel(recorder)
 
 if __name__ == "__main__":
     main()
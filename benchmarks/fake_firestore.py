@@ -0,0 +1,264 @@
+"""
+ベンチマーク用のインメモリ Firestore
+
+FirebaseHandler が使う範囲 (collection / document / where / order_by / limit /
+start_after / stream / get / set / batch / transaction / on_snapshot) だけを実装する。
+ネットワーク遅延はないため、計測されるのはアプリ側の処理時間と読み込み件数
+"""
+import enum
+import operator
+import threading
+from datetime import datetime, timezone
+from firebase_admin import firestore
+
+_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '>=': operator.ge,
+    '>': operator.gt
+}
+
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    MODIFIED = 2
+    REMOVED = 3
+
+
+class DocumentChange:
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+
+class Watch:
+    def __init__(self, collection, callback):
+        self._collection = collection
+        self._callback = callback
+    
+    def unsubscribe(self):
+        if self._callback in self._collection._listeners:
+            self._collection._listeners.remove(self._callback)
+
+
+class DocumentSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+    
+    @property
+    def exists(self):
+        return self._data is not None
+    
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class Query:
+    """条件を積み重ねて stream() で評価するクエリ (元のクエリは変更しない)"""
+    
+    def __init__(self, collection, filters=(), order=None, descending=False,
+                 limit=None, start_after=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._order = order
+        self._descending = descending
+        self._limit = limit
+        self._start_after = start_after
+    
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters,
+            'order': self._order,
+            'descending': self._descending,
+            'limit': self._limit,
+            'start_after': self._start_after
+        }
+        state.update(changes)
+        return Query(self._collection, **state)
+    
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, _OPERATORS[op], value),))
+    
+    def order_by(self, field, direction=None):
+        return self._copy(order=field, descending=direction == firestore.Query.DESCENDING)
+    
+    def limit(self, count):
+        return self._copy(limit=count)
+    
+    def start_after(self, values):
+        return self._copy(start_after=values[self._order] if isinstance(values, dict) else values)
+    
+    def stream(self):
+        docs = self._collection._docs
+        items = [
+            (doc_id, data) for doc_id, data in docs.items()
+            if all(field in data and op(data[field], value)
+                   for field, op, value in self._filters)
+        ]
+        if self._order is not None:
+            items = [(doc_id, data) for doc_id, data in items if self._order in data]
+            items.sort(key=lambda item: item[1][self._order], reverse=self._descending)
+            if self._start_after is not None:
+                after = (operator.lt if self._descending else operator.gt)
+                items = [item for item in items if after(item[1][self._order], self._start_after)]
+        if self._limit is not None:
+            items = items[:self._limit]
+        
+        # 0件のクエリも1回の読み込みとして数える (Firestore の課金と同じ)
+        self._collection._client.reads += max(len(items), 1)
+        return iter([DocumentSnapshot(doc_id, dict(data)) for doc_id, data in items])
+
+
+class DocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+    
+    def get(self, transaction=None):
+        self._collection._client.reads += 1
+        return DocumentSnapshot(self.id, self._collection._docs.get(self.id))
+    
+    def set(self, data, merge=False):
+        data = {
+            key: datetime.now(timezone.utc) if value is firestore.SERVER_TIMESTAMP else value
+            for key, value in data.items()
+        }
+        docs = self._collection._docs
+        change_type = ChangeType.MODIFIED if self.id in docs else ChangeType.ADDED
+        if merge and self.id in docs:
+            docs[self.id].update(data)
+        else:
+            docs[self.id] = data
+        self._collection._client.writes += 1
+        self._collection._notify([(change_type, self.id)])
+
+
+class CollectionReference(Query):
+    def __init__(self, client):
+        super().__init__(self)
+        self._client = client
+        self._docs = {}
+        self._listeners = []
+    
+    def document(self, doc_id):
+        return DocumentReference(self, doc_id)
+    
+    def on_snapshot(self, callback):
+        """
+        リスナーを登録 (Firestore と違い、変更はその場で同じスレッドから通知する)
+        
+        最初に全ドキュメントを ADDED として通知し、その件数を読み込みとして数える
+        """
+        self._listeners.append(callback)
+        self._client.reads += max(len(self._docs), 1)
+        callback(*self._snapshot([(ChangeType.ADDED, doc_id) for doc_id in self._docs]))
+        return Watch(self, callback)
+    
+    def _snapshot(self, changes):
+        documents = [DocumentSnapshot(doc_id, dict(data)) for doc_id, data in self._docs.items()]
+        changes = [
+            DocumentChange(change_type, DocumentSnapshot(doc_id, dict(self._docs[doc_id])))
+            for change_type, doc_id in changes
+        ]
+        return documents, changes, datetime.now(timezone.utc)
+    
+    def _notify(self, changes):
+        if not self._listeners:
+            return
+        # 変更のあったドキュメントも読み込みとして課金される
+        self._client.reads += len(changes) * len(self._listeners)
+        for callback in list(self._listeners):
+            callback(*self._snapshot(changes))
+
+
+class WriteBatch:
+    def __init__(self):
+        self._writes = []
+    
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference, data, merge))
+    
+    def commit(self):
+        for reference, data, merge in self._writes:
+            reference.set(data, merge=merge)
+        self._writes = []
+
+
+class Transaction(WriteBatch):
+    """
+    firestore.transactional に渡すトランザクション
+    
+    競合の検出はせず、クライアント単位のロックで開始からコミットまでを直列化する
+    """
+    
+    def __init__(self, client):
+        super().__init__()
+        self._client = client
+        self._id = None
+        self._read_only = False
+        self._max_attempts = 5
+    
+    def _clean_up(self):
+        self._writes = []
+    
+    def _begin(self, retry_id=None):
+        self._client._lock.acquire()
+        self._id = b'fake-transaction'
+    
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._release()
+    
+    def _rollback(self):
+        self._writes = []
+        self._release()
+    
+    def _release(self):
+        if self._id is not None:
+            self._id = None
+            self._client._lock.release()
+
+
+class FakeFirestore:
+    """
+    firestore.client() の代わりに FirebaseHandler(client=...) に渡すクライアント
+    
+    reads / writes に読み書きしたドキュメント数を数える
+    """
+    
+    def __init__(self):
+        self._collections = {}
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+    
+    def collection(self, path):
+        # 'users/{uid}/weight' のようなサブコレクションのパスもそのままキーにする
+        if path not in self._collections:
+            self._collections[path] = CollectionReference(self)
+        return self._collections[path]
+    
+    def batch(self):
+        return WriteBatch()
+    
+    def transaction(self):
+        return Transaction(self)
+    
+    def load(self, path, documents, timestamp=None):
+        """
+        ドキュメントをまとめて登録 (読み書きの件数には含めない)
+        
+        Args:
+            path: コレクションのパス
+            documents: {ドキュメント ID: データ} の辞書
+            timestamp: timestamp フィールドに入れる時刻 (None の場合は現在時刻)
+        """
+        timestamp = timestamp or datetime.now(timezone.utc)
+        collection = self.collection(path)
+        for doc_id, data in documents.items():
+            collection._docs[doc_id] = dict(data, timestamp=timestamp)
+        collection._notify([(ChangeType.ADDED, doc_id) for doc_id in documents])
@@ -0,0 +1,276 @@
+"""
+合成データとインメモリ Firestore によるベンチマーク
+
+    python -m benchmarks.run                             # 1, 3, 10 年分
+    python -m benchmarks.run --years 1 5 --repeat 20 --output results.json
+    python -m benchmarks.run --baseline results.json     # 遅くなったケースがあれば終了コード 1
+
+結果は JSON (ケース・年数ごとの中央値/最小/p95 [ms] と1回あたりの読み込み件数) で保存し、
+--baseline に前回の結果を渡すと中央値を比較する
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.synthetic import generate_daily_records, populate
+from utils.firebase_handler import FirebaseHandler
+from utils.rolling_stats import window_stats
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 表示期間 (app.py の 週 / 月 / 年)
+PERIOD_DAYS = {'週': 7, '月': 30, '年': 365}
+
+# アドバイス・予測区間に渡す日数 (app.py の FORECAST_HISTORY_DAYS)
+FORECAST_HISTORY_DAYS = 120
+
+
+def main_page_data(fb, period):
+    """app.main_page() が描画前に行うデータの準備 (Streamlit の描画を除く)"""
+    today = datetime.now().date()
+    start_date = today - timedelta(days=PERIOD_DAYS[period])
+    
+    fb.get_weight_history_days()
+    rolling_stats = fb.get_rolling_stats()
+    fb.calculate_consecutive_gym_days()
+    fb.get_daily_frame(start_date=today - timedelta(days=FORECAST_HISTORY_DAYS))
+    settings = fb.get_user_settings()
+    window_stats(rolling_stats, (today - start_date).days + 1, today)
+    
+    filtered_daily = fb.get_daily_frame(start_date=start_date)
+    filtered_weight = filtered_daily['weight'].dropna()
+    gym_days = filtered_daily.loc[filtered_daily['went_to_gym'].fillna(False), 'weight']
+    return filtered_weight, gym_days, settings
+
+
+class Case:
+    """
+    計測する処理
+    
+    Args:
+        name: ケース名
+        func: 保存先を受け取って計測対象の処理を行う関数
+        setup: 計測前に1回だけ呼ぶ関数 (戻り値が func の第2引数になる)
+        cold: True の場合は毎回クエリキャッシュを消してから計測
+    """
+    
+    def __init__(self, name: str, func: Callable, setup: Optional[Callable] = None,
+                 cold: bool = True):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.cold = cold
+
+
+def _predictor(fb):
+    from utils.ml_predictor import HealthPredictor
+    
+    return HealthPredictor(
+        fb.get_daily_frame(),
+        history_days=fb.get_weight_history_days(),
+        trend=fb.get_weight_trend(),
+        rolling_stats=fb.get_rolling_stats()
+    )
+
+
+def _memoized_predictor(fb):
+    from utils.ml_predictor import HealthPredictor
+    
+    # data_key を渡すと2回目以降はメモから返す
+    return HealthPredictor(
+        fb.get_daily_frame(),
+        history_days=fb.get_weight_history_days(),
+        rolling_stats=fb.get_rolling_stats(),
+        data_key=fb.data_key()
+    )
+
+
+def _advice(fb, predictor):
+    result = predictor.get_daily_advice()
+    predictor.wait_for_recipes(result)
+
+
+def _chart_inputs(fb):
+    fb.clear_cache()
+    return main_page_data(fb, '年')
+
+
+def _build_chart(fb, inputs):
+    from utils.chart import build_weight_figure
+    
+    weight, gym_days, settings = inputs
+    build_weight_figure(weight, gym_days, settings.get('weight_goal', 70.0))
+
+
+def _listener(fb):
+    # 同じクライアントに on_snapshot リスナーで読むハンドラを作る (初回の全件読み込みは計測外)
+    return FirebaseHandler(sync_dir=False, client=fb.db, listen=True)
+
+
+def _aggregate(fb, period):
+    start_date = datetime.now().date() - timedelta(days=PERIOD_DAYS[period])
+    fb.count_gym_days(start_date)
+    fb.average_calories(start_date)
+
+
+CASES = [
+    Case('get_weight_data', lambda fb, _: fb.get_weight_data()),
+    Case('fill_missing_dates', lambda fb, raw: fb._fill_missing_dates(raw),
+         setup=lambda fb: fb._query_collection('weight', 'weight'), cold=False),
+    Case('calculate_consecutive_gym_days', lambda fb, _: fb.calculate_consecutive_gym_days()),
+    Case('recompute_gym_streak', lambda fb, _: fb.recompute_gym_streak()),
+    Case('get_daily_advice', _advice, setup=_predictor, cold=False),
+    Case('predict_future_weight', lambda fb, predictor: predictor.predict_future_weight(),
+         setup=_predictor, cold=False),
+    Case('predict_weight_interval', lambda fb, predictor: predictor.predict_weight_interval(),
+         setup=_predictor, cold=False),
+    Case('predict_weight_interval[memo]',
+         lambda fb, predictor: predictor.predict_weight_interval(),
+         setup=_memoized_predictor, cold=False),
+    Case('main_page_data[週]', lambda fb, _: main_page_data(fb, '週')),
+    Case('main_page_data[年]', lambda fb, _: main_page_data(fb, '年')),
+    Case('main_page_data[年, warm]', lambda fb, _: main_page_data(fb, '年'), cold=False),
+    Case('build_weight_figure[年]', _build_chart, setup=_chart_inputs, cold=False),
+    Case('aggregate[年]', lambda fb, _: _aggregate(fb, '年')),
+    Case('main_page_data[年, listen]', lambda fb, listener: main_page_data(listener, '年'),
+         setup=_listener)
+]
+
+
+def make_storage(years: float, seed: int = 0):
+    """years 年分の合成データを入れた FakeFirestore を使う FirebaseHandler"""
+    client = FakeFirestore()
+    records = populate(client, generate_daily_records(years, seed=seed))
+    fb = FirebaseHandler(sync_dir=False, client=client)
+    fb.clear_cache()
+    return fb, client, records
+
+
+def run_case(fb, client, case: Case, repeat: int) -> Dict:
+    arg = case.setup(fb) if case.setup else None
+    # サマリーの作成などの初回だけの処理を除くため1回空実行する
+    case.func(fb, arg)
+    
+    durations = []
+    reads = 0
+    for _ in range(repeat):
+        if case.cold:
+            fb.clear_cache()
+        before = client.reads
+        start = time.perf_counter()
+        case.func(fb, arg)
+        durations.append((time.perf_counter() - start) * 1000)
+        reads += client.reads - before
+    
+    return {
+        'median_ms': float(np.median(durations)),
+        'min_ms': float(np.min(durations)),
+        'p95_ms': float(np.percentile(durations, 95)),
+        'docs_read': reads / repeat
+    }
+
+
+def run(years_list: List[float], repeat: int, cases: Optional[List[str]] = None,
+        seed: int = 0) -> Dict:
+    results = []
+    for years in years_list:
+        fb, client, records = make_storage(years, seed)
+        for case in CASES:
+            if cases and case.name not in cases:
+                continue
+            result = run_case(fb, client, case, repeat)
+            results.append(dict(case=case.name, years=years, records=records, **result))
+            print(f"{case.name:<32} {years:>5g}年 {result['median_ms']:>10.2f} ms "
+                  f"(p95 {result['p95_ms']:>9.2f}) reads {result['docs_read']:>8.1f}",
+                  file=sys.stderr)
+    return {'meta': _metadata(repeat, seed), 'results': results}
+
+
+def _metadata(repeat: int, seed: int) -> Dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+            capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'seed': seed
+    }
+
+
+def compare(report: Dict, baseline: Dict, threshold: float = 0.2,
+            min_delta_ms: float = 1.0) -> List[Dict]:
+    """
+    前回の結果より中央値が threshold 以上 (かつ min_delta_ms 以上) 遅くなったケース
+    """
+    previous = {(r['case'], r['years']): r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        base = previous.get((result['case'], result['years']))
+        if base is None:
+            continue
+        delta = result['median_ms'] - base['median_ms']
+        if delta > min_delta_ms and result['median_ms'] > base['median_ms'] * (1 + threshold):
+            regressions.append({
+                'case': result['case'],
+                'years': result['years'],
+                'baseline_ms': base['median_ms'],
+                'median_ms': result['median_ms'],
+                'ratio': result['median_ms'] / base['median_ms']
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成データによるベンチマーク')
+    parser.add_argument('--years', type=float, nargs='+', default=[1, 3, 10],
+                        help='データの年数 (複数指定可)')
+    parser.add_argument('--repeat', type=int, default=10, help='ケースごとの計測回数')
+    parser.add_argument('--case', action='append', help='計測するケース名 (省略時は全て)')
+    parser.add_argument('--seed', type=int, default=0, help='合成データの乱数シード')
+    parser.add_argument('--output', help='結果の JSON を保存するパス (- で標準出力)')
+    parser.add_argument('--baseline', help='比較する前回の結果の JSON')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='遅くなったとみなす中央値の増加率')
+    args = parser.parse_args()
+    
+    report = run(args.years, args.repeat, args.case, args.seed)
+    
+    if args.output == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"遅くなりました: {r['case']} ({r['years']:g}年) "
+                  f"{r['baseline_ms']:.2f} → {r['median_ms']:.2f} ms (x{r['ratio']:.2f})",
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+ベンチマーク用の合成データ
+
+体重はゆっくりした傾向 + 季節変動 + 日々のばらつき、ジムは続きやすい/休みが続きやすい
+2状態のマルコフ連鎖、消費カロリーはジムの日に多くなるように作る。
+記録のない日 (単発の記録忘れと、旅行などで数日〜数週間続く空白) も含める
+"""
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+
+def generate_daily_records(years, end_date=None, seed=0, skip_rate=0.1, gap_rate=0.01,
+                           max_gap_days=21):
+    """
+    years 年分の日次記録を作成
+    
+    Args:
+        years: 何年分か
+        end_date: 最終日 (None の場合は今日)
+        seed: 乱数のシード
+        skip_rate: 1日単位で記録を忘れる確率 (項目ごと)
+        gap_rate: その日から数日間まとめて記録が途切れる確率
+        max_gap_days: まとめて途切れる最大日数
+    
+    Returns:
+        DatetimeIndex の DataFrame (列: weight, went_to_gym, calories、記録なしは欠損値)
+    """
+    rng = np.random.default_rng(seed)
+    end_date = pd.Timestamp(end_date or datetime.now().date())
+    dates = pd.date_range(end=end_date, periods=int(round(365 * years)), freq='D')
+    n = len(dates)
+    
+    # 体重: ランダムウォークの傾向 + 年周期 + 測定のばらつき
+    drift = np.cumsum(rng.normal(0, 0.05, n))
+    seasonal = 0.8 * np.sin(2 * np.pi * np.arange(n) / 365.25)
+    weight = np.round(72 + drift + seasonal + rng.normal(0, 0.3, n), 1)
+    
+    # ジム: 行った翌日は 60%、休んだ翌日は 40% で行く
+    went = np.empty(n, dtype=bool)
+    went[0] = rng.random() < 0.5
+    draws = rng.random(n)
+    for i in range(1, n):
+        went[i] = draws[i] < (0.6 if went[i - 1] else 0.4)
+    
+    calories = np.where(went, rng.normal(650, 120, n), rng.normal(300, 90, n))
+    calories = np.clip(np.round(calories), 0, 3000)
+    
+    frame = pd.DataFrame({
+        'weight': weight,
+        'went_to_gym': pd.array(went, dtype='boolean'),
+        'calories': calories
+    }, index=pd.DatetimeIndex(dates, name='date'))
+    
+    # 項目ごとの単発の記録忘れ
+    for column in frame.columns:
+        frame.loc[rng.random(n) < skip_rate, column] = pd.NA
+    
+    # 数日〜数週間続く空白 (全項目)
+    for start in np.flatnonzero(rng.random(n) < gap_rate):
+        length = int(rng.integers(2, max_gap_days + 1))
+        frame.iloc[start:start + length] = pd.NA
+    
+    frame['weight'] = frame['weight'].astype(float)
+    frame['calories'] = frame['calories'].astype(float)
+    return frame
+
+
+def to_documents(frame):
+    """
+    日次記録をコレクションごとの Firestore ドキュメントに変換
+    
+    Returns:
+        {'weight': {日付: {'date', 'weight'}}, 'gym': {...}, 'calories': {...}}
+    """
+    documents = {}
+    for collection, field in (('weight', 'weight'), ('gym', 'went_to_gym'),
+                              ('calories', 'calories')):
+        values = frame[field].dropna()
+        if field == 'went_to_gym':
+            values = values.astype(bool)
+        elif field == 'calories':
+            values = values.astype(int)
+        documents[collection] = {
+            date.strftime('%Y-%m-%d'): {'date': date.strftime('%Y-%m-%d'), field: value.item()}
+            for date, value in zip(values.index, values.to_numpy())
+        }
+    return documents
+
+
+def populate(client, frame, collection_names=None):
+    """
+    FakeFirestore に日次記録を登録
+    
+    Args:
+        client: benchmarks.fake_firestore.FakeFirestore
+        frame: generate_daily_records() の戻り値
+        collection_names: 論理名とコレクションのパスの対応 (None の場合はそのまま)
+    
+    Returns:
+        登録したドキュメント数
+    """
+    collection_names = collection_names or {}
+    count = 0
+    for collection, documents in to_documents(frame).items():
+        client.load(collection_names.get(collection, collection), documents)
+        count += len(documents)
+    return count
+
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.fake_firestore import FakeFirestore
+from utils.firebase_handler import FirebaseHandler
+from utils.ml_predictor import HealthPredictor
+from utils.weight_trend import compute_weight_trend
+
+
+def _save_weights(fb, weights):
+    for date, weight in weights.items():
+        fb.save_weight(date, weight)
+
+
+def _history(days, gap_days):
+    """days 日分の体重 (途中と最後の gap_days 日は記録なし)"""
+    today = datetime.now().date()
+    dates = [today - timedelta(days=gap_days + i) for i in range(days)][::-1]
+    rng = np.random.default_rng(0)
+    weights = np.round(72 - 0.02 * np.arange(days) + rng.normal(0, 0.3, days), 1)
+    history = dict(zip(dates, weights))
+    for date in dates[10:15]:
+        del history[date]
+    return history
+
+
+def test_incremental_trend_matches_rebuild():
+    fb = FirebaseHandler(sync_dir=False, client=FakeFirestore(), listen=False)
+    _save_weights(fb, _history(60, gap_days=20))
+    
+    stored = fb.get_weight_trend().to_dict()
+    rebuilt = compute_weight_trend(fb._query_collection('weight', 'weight'))
+    assert stored['last_x'] == rebuilt['last_x']
+    np.testing.assert_allclose(stored['sums'], rebuilt['sums'])
+
+
+def test_stored_trend_and_fallback_predict_the_same():
+    fb = FirebaseHandler(sync_dir=False, client=FakeFirestore(), listen=False)
+    _save_weights(fb, _history(60, gap_days=20))
+    daily_df = fb.get_daily_frame()
+    history_days = fb.get_weight_history_days()
+    
+    stored = HealthPredictor(daily_df, history_days=history_days, trend=fb.get_weight_trend())
+    fallback = HealthPredictor(daily_df, history_days=history_days)
+    
+    np.testing.assert_allclose(
+        stored.predict_future_weight(7), fallback.predict_future_weight(7)
+    )
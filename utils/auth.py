@@ -1,8 +1,168 @@
 import streamlit as st
-from utils.firebase_handler import FirebaseHandler
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from utils.storage import HealthStorage, create_storage, _secrets_section
 
-def check_password():
-    """パスワード認証"""
+# パスワードハッシュ (PBKDF2-HMAC-SHA256) の反復回数
+PBKDF2_ITERATIONS = 200_000
+
+# セッショントークンの有効期間 (秒)。「ログイン状態を保持する」を選んだ場合だけ発行する
+TOKEN_TTL = 7 * 24 * 3600
+
+# 照合用データをプロセス内に保持する秒数
+VERIFIER_TTL = 300
+
+# セッショントークンを置く URL のクエリパラメータ
+TOKEN_PARAM = 'session'
+
+# secrets に auth.secret_key がない場合はプロセスごとの鍵 (再起動でトークンは無効になる)
+_fallback_secret = secrets.token_bytes(32)
+
+# ユーザー ID ごとの照合用データ
+# {user_id: (取得時刻, password_version, password_hash, password, token_version)}
+_verifiers = {}
+_verifiers_lock = threading.Lock()
+
+def is_multi_user():
+    """secrets の auth.multi_user が有効ならユーザーごとにデータを分ける"""
+    return bool(_secrets_section('auth').get('multi_user', False))
+
+def is_valid_user_id(user_id):
+    """ユーザー ID として使えるか (空の ID は1人用のデータに繋がるため不可)"""
+    return isinstance(user_id, str) and bool(HealthStorage.USER_ID_PATTERN.fullmatch(user_id))
+
+def current_user_id():
+    """ログイン中のユーザー ID (1人用の構成では None)"""
+    return st.session_state.get('user_id')
+
+# パスワードハッシュ
+def hash_password(password, salt=None, iterations=PBKDF2_ITERATIONS):
+    """
+    ソルト付きのパスワードハッシュを作成
+    
+    Returns:
+        'pbkdf2_sha256$反復回数$ソルト$ハッシュ' 形式の文字列
+    """
+    salt = salt or secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+    return f'pbkdf2_sha256${iterations}${salt}${digest.hex()}'
+
+def check_password_hash(password, encoded):
+    """hash_password() の結果とパスワードを照合"""
+    try:
+        algorithm, iterations, salt, expected = encoded.split('$')
+    except (AttributeError, ValueError):
+        return False
+    if algorithm != 'pbkdf2_sha256':
+        return False
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), int(iterations))
+    return hmac.compare_digest(digest.hex(), expected)
+
+def with_password(settings, password):
+    """
+    パスワードを変更した設定を返す
+    
+    平文のパスワードは保存せず、バージョンを上げて発行済みのトークンを無効にする
+    """
+    new_settings = {key: value for key, value in settings.items() if key != 'password'}
+    new_settings['password_hash'] = hash_password(password)
+    new_settings['password_version'] = settings.get('password_version', 0) + 1
+    return new_settings
+
+# 照合用データのキャッシュ
+def _get_verifier(fb, user_id):
+    """
+    (password_version, password_hash, 平文パスワード, token_version) をプロセス内のキャッシュから取得
+    
+    ユーザーが存在しない場合は None
+    """
+    with _verifiers_lock:
+        cached = _verifiers.get(user_id)
+    if cached is not None and time.monotonic() - cached[0] < VERIFIER_TTL:
+        return cached[1:]
+    
+    # 複数ユーザーの構成では未登録のユーザーを作成しない
+    settings = fb.get_user_settings(create=user_id is None)
+    if settings is None:
+        return None
+    
+    verifier = (
+        settings.get('password_version', 0),
+        settings.get('password_hash'),
+        settings.get('password') if 'password_hash' not in settings else None,
+        settings.get('token_version', 0)
+    )
+    with _verifiers_lock:
+        _verifiers[user_id] = (time.monotonic(),) + verifier
+    return verifier
+
+def invalidate_verifier(user_id=None):
+    """パスワード変更後に照合用データを読み直させる"""
+    with _verifiers_lock:
+        _verifiers.pop(user_id, None)
+
+# セッショントークン
+def _secret_key():
+    key = _secrets_section('auth').get('secret_key')
+    return key.encode() if key else _fallback_secret
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def issue_token(user_id, version, token_version=0, ttl=TOKEN_TTL):
+    """
+    ユーザー ID とパスワード・トークンのバージョンに署名したセッショントークンを発行
+    
+    パスワードの変更とログアウトでそれぞれのバージョンが上がり、発行済みのトークンは無効になる
+    """
+    payload = _b64encode(json.dumps(
+        {'u': user_id, 'v': version, 't': token_version, 'exp': int(time.time()) + ttl},
+        separators=(',', ':')
+    ).encode())
+    signature = hmac.new(_secret_key(), payload.encode(), hashlib.sha256).digest()
+    return f'{payload}.{_b64encode(signature)}'
+
+def read_token(token):
+    """
+    署名と有効期限を確認してトークンの内容を返す (データベースには問い合わせない)
+    
+    Returns:
+        {'u': ユーザー ID, 'v': パスワードのバージョン, 't': トークンのバージョン, 'exp': 期限}
+        (無効な場合は None)
+    """
+    try:
+        payload, signature = token.split('.')
+        expected = hmac.new(_secret_key(), payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None
+        data = json.loads(_b64decode(payload))
+    except (AttributeError, ValueError):
+        return None
+    return data if data.get('exp', 0) > time.time() else None
+
+# ログイン
+# 照合のたびに保存先 (SQLite の接続や Firestore クライアント) を作り直さないよう、
+# ユーザー ID ごとに1つ作成して全セッションで共有する
+@st.cache_resource(max_entries=1000)
+def _auth_storage(user_id=None):
+    """照合用の保存先 (リスナーは開かない)"""
+    return create_storage(user_id, listen=False)
+
+def check_password(get_storage=_auth_storage):
+    """
+    パスワード認証
+    
+    Args:
+        get_storage: ユーザー ID から保存先を返す関数 (リスナーを開かないもの)
+    """
     
     if 'authenticated' not in st.session_state:
         st.session_state.authenticated = False
@@ -10,29 +170,119 @@ def check_password():
     if st.session_state.authenticated:
         return True
     
-    # Firebase設定取得
-    fb = FirebaseHandler()
-    settings = fb.get_user_settings()
-    correct_password = settings.get('password', 'yasu0122')
+    multi_user = is_multi_user()
+    
+    # 署名済みトークンがあればパスワード入力を省略
+    if _login_with_token(get_storage, multi_user):
+        return True
     
     st.title("🔐 ログイン")
     
+    user_id = None
+    if multi_user:
+        user_id = st.text_input("ユーザーIDを入力してください", key="user_id_input").strip()
+    
     password = st.text_input("パスワードを入力してください", type="password", key="password_input")
+    remember = st.checkbox(
+        "ログイン状態を保持する",
+        key="remember_input",
+        help="URL にログイン用のトークンを付けます。共有する端末や URL を人に送る場合は使わないでください"
+    )
     
     col1, col2, col3 = st.columns([1, 1, 1])
     
     with col2:
         if st.button("ログイン", type="primary", use_container_width=True):
-            if password == correct_password:
+            # 保存先を作る前に ID を確認する
+            if multi_user and not is_valid_user_id(user_id):
+                st.error("❌ ユーザーIDは英数字・ハイフン・アンダースコア (64文字以内) で入力してください")
+                return False
+            versions = _verify(get_storage, user_id, password)
+            if versions is not None:
                 st.session_state.authenticated = True
+                st.session_state.user_id = user_id
+                st.session_state.remembered = remember
+                if remember:
+                    st.query_params[TOKEN_PARAM] = issue_token(user_id, *versions)
                 st.success("✅ ログイン成功!")
                 st.rerun()
+            elif multi_user:
+                st.error("❌ ユーザーIDまたはパスワードが間違っています")
             else:
                 st.error("❌ パスワードが間違っています")
     
     return False
 
-def logout():
-    """ログアウト"""
+def _login_with_token(get_storage, multi_user):
+    data = read_token(st.query_params.get(TOKEN_PARAM))
+    if data is None:
+        return False
+    if multi_user and not is_valid_user_id(data.get('u')):
+        return False
+    if not multi_user and data.get('u') is not None:
+        return False
+    
+    # パスワードの変更・ログアウト後はトークンは無効
+    try:
+        verifier = _get_verifier(get_storage(data['u']), data['u'])
+    except ValueError:
+        return False
+    if verifier is None or verifier[0] != data.get('v') or verifier[3] != data.get('t', 0):
+        return False
+    
+    st.session_state.authenticated = True
+    st.session_state.remembered = True
+    st.session_state.user_id = data['u']
+    return True
+
+def _verify(get_storage, user_id, password):
+    """
+    パスワードを照合
+    
+    Returns:
+        一致した場合は (パスワードのバージョン, トークンのバージョン)、一致しない場合は None
+    """
+    try:
+        fb = get_storage(user_id)
+    except ValueError:
+        return None
+    
+    verifier = _get_verifier(fb, user_id)
+    if verifier is None:
+        return None
+    version, password_hash, plain_password, token_version = verifier
+    
+    if password_hash is not None:
+        if not check_password_hash(password, password_hash):
+            return None
+        return version, token_version
+    
+    # 平文で保存されている古い設定は、ログイン成功時にハッシュへ移行する
+    if plain_password is None or not hmac.compare_digest(password.encode(), plain_password.encode()):
+        return None
+    settings = with_password(fb.get_user_settings(), password)
+    fb.update_user_settings(settings)
+    invalidate_verifier(user_id)
+    return settings['password_version'], token_version
+
+def logout(get_storage=_auth_storage):
+    """
+    ログアウト
+    
+    ログイン状態を保持していた場合はトークンのバージョンを上げ、
+    URL や履歴に残ったトークンを (他の端末のものも含めて) 無効にする
+    """
+    user_id = current_user_id()
+    if st.session_state.get('remembered'):
+        fb = get_storage(user_id)
+        settings = fb.get_user_settings(create=False)
+        if settings is not None:
+            settings['token_version'] = settings.get('token_version', 0) + 1
+            fb.update_user_settings(settings)
+        invalidate_verifier(user_id)
+    
     st.session_state.authenticated = False
+    st.session_state.user_id = None
+    st.session_state.remembered = False
+    st.query_params.pop(TOKEN_PARAM, None)
     st.rerun()
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Theil–Sen は組み合わせ数が多いので予測起点をこの件数ずつまとめて計算する
+_THEIL_SEN_BLOCK = 512
+
+
+def _linear(windows, horizons):
+    """各ウィンドウの最小二乗直線で予測"""
+    length = windows.shape[1]
+    x = np.arange(length, dtype=float)
+    x_centered = x - x.mean()
+    slope = windows @ x_centered / (x_centered @ x_centered)
+    intercept = windows.mean(axis=1) - slope * x.mean()
+    return intercept[:, None] + slope[:, None] * (length - 1 + horizons)[None, :]
+
+
+def _holt(windows, horizons, alpha=0.3, beta=0.1):
+    """
+    Holt の二重指数平滑化で予測
+    
+    時刻方向にはループするが、全ての予測起点をまとめて更新する
+    """
+    level = windows[:, 0].copy()
+    trend = windows[:, 1] - windows[:, 0]
+    for t in range(1, windows.shape[1]):
+        previous_level = level
+        level = alpha * windows[:, t] + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+    return level[:, None] + trend[:, None] * horizons[None, :]
+
+
+def _theil_sen(windows, horizons):
+    """2点間の傾きの中央値を使う外れ値に強い直線で予測"""
+    length = windows.shape[1]
+    x = np.arange(length, dtype=float)
+    i, j = np.triu_indices(length, k=1)
+    
+    forecasts = np.empty((windows.shape[0], len(horizons)))
+    for start in range(0, windows.shape[0], _THEIL_SEN_BLOCK):
+        block = windows[start:start + _THEIL_SEN_BLOCK]
+        slope = np.median((block[:, j] - block[:, i]) / (j - i), axis=1)
+        intercept = np.median(block - slope[:, None] * x[None, :], axis=1)
+        forecasts[start:start + _THEIL_SEN_BLOCK] = (
+            intercept[:, None] + slope[:, None] * (length - 1 + horizons)[None, :]
+        )
+    return forecasts
+
+
+def _naive(windows, horizons):
+    """最後の値がそのまま続くとする基準モデル"""
+    return np.repeat(windows[:, -1:], len(horizons), axis=1)
+
+
+FORECASTERS = {
+    'linear': _linear,
+    'holt': _holt,
+    'theil_sen': _theil_sen,
+    'naive': _naive
+}
+
+
+def backtest(weights, window=30, horizon=7, models=None):
+    """
+    全ての予測起点でモデルを評価 (ローリング・オリジン方式)
+    
+    Args:
+        weights: 1日1件の体重 (欠損のない日付順の配列)
+        window: 予測に使う直近の日数 (2以上)
+        horizon: 何日先まで評価するか
+        models: 評価するモデル名のリスト (None の場合は全て)
+    
+    Returns:
+        (model, horizon) をインデックスとする DataFrame
+        列: mae, rmse, bias, q10, q90 (誤差 = 実測 - 予測 の分位点), origins
+    """
+    y = np.asarray(weights, dtype=float)
+    models = models or list(FORECASTERS)
+    horizons = np.arange(1, horizon + 1)
+    origins = len(y) - window - horizon + 1
+    
+    if origins <= 0:
+        return pd.DataFrame(
+            columns=['mae', 'rmse', 'bias', 'q10', 'q90', 'origins'],
+            index=pd.MultiIndex.from_tuples([], names=['model', 'horizon'])
+        )
+    
+    # コピーせずに全ての起点のウィンドウと正解値を作る
+    windows = sliding_window_view(y, window)[:origins]
+    actuals = sliding_window_view(y[window:], horizon)[:origins]
+    
+    rows = []
+    for name in models:
+        errors = actuals - FORECASTERS[name](windows, horizons)
+        q10, q90 = np.quantile(errors, [0.1, 0.9], axis=0)
+        for k in range(horizon):
+            rows.append({
+                'model': name,
+                'horizon': k + 1,
+                'mae': np.abs(errors[:, k]).mean(),
+                'rmse': np.sqrt((errors[:, k] ** 2).mean()),
+                'bias': errors[:, k].mean(),
+                'q10': q10[k],
+                'q90': q90[k],
+                'origins': origins
+            })
+    return pd.DataFrame(rows).set_index(['model', 'horizon'])
+
+
+def best_model(report):
+    """全ホライズンの平均 MAE が最小のモデル名"""
+    return report['mae'].groupby(level='model').mean().idxmin()
+
+
+def forecast(weights, model, window=30, horizon=7):
+    """直近 window 日分から horizon 日先までを予測"""
+    y = np.asarray(weights, dtype=float)[-window:]
+    return FORECASTERS[model](y[None, :], np.arange(1, horizon + 1))[0]
@@ -0,0 +1,150 @@
+import numpy as np
+
+# グラフに送る体重の最大点数 (グラフ幅 1000px 前後で 3px に1点程度)
+MAX_POINTS = 300
+
+# 描画する点数 (間引いた体重ライン + 間引かないジムのマーカー) がこれを超えたら
+# WebGL (Scattergl) で描画する。ジムのマーカーは記録期間に比例して増える
+WEBGL_THRESHOLD = 1000
+
+# これ以下の点数のときだけ線の上にマーカーを表示する
+MARKER_THRESHOLD = 120
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets で残す点のインデックスを選ぶ
+    
+    最初と最後の点は必ず残し、間を threshold - 2 個のバケットに分けて
+    前に選んだ点・次のバケットの平均と作る三角形が最大の点を1つずつ選ぶ
+    
+    Args:
+        x: 昇順の x 座標 (数値)
+        y: y 座標
+        threshold: 残す点数
+    
+    Returns:
+        残す点のインデックス (昇順の numpy 配列)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    
+    # バケットの境界 (最初と最後の点は除く)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    
+    previous = 0
+    for b in range(threshold - 2):
+        start, end = edges[b], edges[b + 1]
+        next_start, next_end = end, edges[b + 2] if b + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        
+        # 三角形の面積 (の2倍) をバケット内でまとめて計算
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(area.argmax())
+        selected[b + 1] = previous
+    return selected
+
+
+def downsample_series(series, max_points=MAX_POINTS):
+    """
+    日付インデックスの Series を LTTB で max_points 点以下に間引く
+    
+    Args:
+        series: 欠損のない日付インデックスの Series
+        max_points: 残す最大点数
+    
+    Returns:
+        間引いた Series (点数が少なければそのまま)
+    """
+    if len(series) <= max_points:
+        return series
+    x = series.index.asi8.astype(float)
+    return series.iloc[lttb_indices(x, series.values, max_points)]
+
+
+def build_weight_figure(weight, gym_days, weight_goal, max_points=MAX_POINTS):
+    """
+    体重推移グラフを作成
+    
+    体重は点数の上限まで間引き、ジムに行った日のマーカーは全て残す。
+    点数が多い場合は WebGL で描画し、目標体重は点の列ではなく1本の線 (shape) で描く
+    
+    Args:
+        weight: 日付インデックスの体重 Series
+        gym_days: ジムに行った日の体重 Series (日付インデックス)
+        weight_goal: 目標体重
+        max_points: 体重ラインの最大点数
+    
+    Returns:
+        plotly の Figure
+    """
+    import plotly.graph_objects as go
+    
+    line = downsample_series(weight, max_points)
+    scatter = go.Scattergl if len(line) + len(gym_days) > WEBGL_THRESHOLD else go.Scatter
+    
+    fig = go.Figure()
+    
+    # 体重ライン
+    fig.add_trace(scatter(
+        x=line.index,
+        y=line.values,
+        mode='lines+markers' if len(line) <= MARKER_THRESHOLD else 'lines',
+        name='体重',
+        line=dict(color='#1f77b4', width=3),
+        marker=dict(size=8),
+        hovertemplate='<b>日付</b>: %{x|%Y-%m-%d}<br><b>体重</b>: %{y:.1f} kg<extra></extra>'
+    ))
+    
+    # 目標体重ライン
+    fig.add_hline(
+        y=weight_goal,
+        line=dict(color='red', width=2, dash='dash'),
+        annotation_text=f'目標体重 {weight_goal:.1f} kg',
+        annotation_position='top left'
+    )
+    
+    # ジムに行った日をマーク
+    if not gym_days.empty:
+        fig.add_trace(scatter(
+            x=gym_days.index,
+            y=gym_days.values,
+            mode='markers',
+            name='ジム',
+            marker=dict(
+                size=15 if len(gym_days) <= MARKER_THRESHOLD else 8,
+                color='green',
+                symbol='star',
+                line=dict(color='darkgreen', width=2)
+            ),
+            hovertemplate='<b>ジムに行った日</b><br>%{x|%Y-%m-%d}<extra></extra>'
+        ))
+    
+    fig.update_layout(
+        title=dict(
+            text="体重推移グラフ",
+            font=dict(size=24, color='#1f77b4')
+        ),
+        xaxis_title="日付",
+        yaxis_title="体重 (kg)",
+        hovermode="x unified",
+        height=500,
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+    return fig
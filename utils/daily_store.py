@@ -0,0 +1,339 @@
+import os
+import numpy as np
+import pandas as pd
+
+# 日付は EPOCH からの日数を配列の位置にする
+EPOCH = np.datetime64('2000-01-01', 'D')
+
+# ファイルの先頭 (マジック, 先頭日, 日数, コレクションごとの最終同期時刻)
+_MAGIC = b'HDSTORE1'
+_HEADER_SIZE = 64
+_COLLECTIONS = ('weight', 'gym', 'calories')
+
+# 配列を伸ばすときの単位 (日数、8 の倍数)
+_GROWTH_DAYS = 368
+
+# カロリーの未記録を表す値
+CALORIES_MISSING = -1
+
+# 最終同期時刻 (UNIX 時刻のマイクロ秒) の未同期を表す値
+_NOT_SYNCED = -1
+
+
+def forward_fill(values):
+    """
+    1次元配列の欠損値 (NaN) を直前の値で埋める (ループを使わない)
+    
+    先頭から最初の値までは NaN のまま
+    """
+    values = np.asarray(values)
+    # 先頭が欠損値なら位置 0 の NaN を参照するので、最初の値までは NaN のまま
+    index = np.where(~np.isnan(values), np.arange(len(values)), 0)
+    np.maximum.accumulate(index, out=index)
+    return values[index]
+
+
+def _to_day(date):
+    return np.datetime64(pd.Timestamp(date).date(), 'D')
+
+
+class DailyStore:
+    """
+    1日1要素の配列で日次データを持つコンパクトな保存形式
+    
+    体重は float32 (未記録は NaN)、消費カロリーは int16 (未記録は -1)、
+    ジムは「記録あり」と「行った」の2つのビット列で持ち、1年あたり約 2.3 KB。
+    path を指定するとファイルをメモリマップして使い、日付から位置を計算するので
+    1日の読み書きは O(1)、期間の取り出しはコピーしない配列のスライスになる
+    
+    Args:
+        path: 保存するファイル (None の場合はメモリ上だけ)
+    """
+    
+    def __init__(self, path=None):
+        self.path = path
+        self._start = 0
+        self._capacity = 0
+        self._buffer = None
+        if path and os.path.exists(path):
+            self._open(path)
+        else:
+            self._allocate(0, 0)
+    
+    # ファイル形式
+    @staticmethod
+    def _layout(capacity):
+        weight = _HEADER_SIZE
+        calories = weight + 4 * capacity
+        gym_recorded = calories + 2 * capacity
+        gym_went = gym_recorded + capacity // 8
+        return weight, calories, gym_recorded, gym_went, gym_went + capacity // 8
+    
+    def _map(self, buffer, start, capacity):
+        weight, calories, gym_recorded, gym_went, end = self._layout(capacity)
+        self._buffer = buffer
+        self._start = start
+        self._capacity = capacity
+        self._header = buffer[:_HEADER_SIZE]
+        self._synced = buffer[16:16 + 8 * len(_COLLECTIONS)].view(np.int64)
+        self._weight = buffer[weight:calories].view(np.float32)
+        self._calories = buffer[calories:gym_recorded].view(np.int16)
+        self._gym_recorded = buffer[gym_recorded:gym_went]
+        self._gym_went = buffer[gym_went:end]
+    
+    def _new_buffer(self, start, capacity):
+        size = self._layout(capacity)[-1]
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            buffer = np.memmap(self.path + '.tmp', dtype=np.uint8, mode='w+', shape=(size,))
+        else:
+            buffer = np.zeros(size, dtype=np.uint8)
+        buffer[:8] = np.frombuffer(_MAGIC, dtype=np.uint8)
+        buffer[8:16] = np.array([start, capacity], dtype=np.int32).view(np.uint8)
+        return buffer
+    
+    def _allocate(self, start, capacity):
+        """空の配列を確保 (ファイルの場合は一時ファイルに作ってから置き換える)"""
+        buffer = self._new_buffer(start, capacity)
+        self._map(buffer, start, capacity)
+        self._synced[:] = _NOT_SYNCED
+        self._weight[:] = np.nan
+        self._calories[:] = CALORIES_MISSING
+        self._replace_file()
+    
+    def _replace_file(self):
+        if self.path:
+            self._buffer.flush()
+            os.replace(self.path + '.tmp', self.path)
+            self._open(self.path)
+    
+    def _open(self, path):
+        buffer = np.memmap(path, dtype=np.uint8, mode='r+')
+        if bytes(buffer[:8]) != _MAGIC:
+            raise ValueError(f'{path} は日次データのファイルではありません')
+        start, capacity = buffer[8:16].view(np.int32)
+        self._map(buffer, int(start), int(capacity))
+    
+    def flush(self):
+        if isinstance(self._buffer, np.memmap):
+            self._buffer.flush()
+    
+    @property
+    def nbytes(self):
+        return self._buffer.nbytes
+    
+    # 位置の計算
+    def _position(self, date):
+        return int((_to_day(date) - EPOCH).astype(int)) - self._start
+    
+    def _ensure(self, first, last):
+        """first〜last (EPOCH からの日数) が収まるよう配列を伸ばす"""
+        end = self._start + self._capacity
+        if self._capacity and first >= self._start and last < end:
+            return
+        
+        # 伸ばすたびにコピーしないよう、伸ばす側に余裕を持たせる
+        if not self._capacity:
+            start, end = first, last + 1 + _GROWTH_DAYS
+        else:
+            start = self._start if first >= self._start else first - _GROWTH_DAYS
+            end = end if last < end else last + 1 + _GROWTH_DAYS
+        capacity = -(-(end - start) // 8) * 8
+        
+        old = (self._start, self._capacity, self._synced.copy(), self._weight.copy(),
+               self._calories.copy(), self._unpack(self._gym_recorded),
+               self._unpack(self._gym_went))
+        self._allocate(start, capacity)
+        old_start, old_capacity, synced, weight, calories, recorded, went = old
+        self._synced[:] = synced
+        if old_capacity:
+            offset = old_start - start
+            self._weight[offset:offset + old_capacity] = weight
+            self._calories[offset:offset + old_capacity] = calories
+            self._set_bits(self._gym_recorded, offset, recorded)
+            self._set_bits(self._gym_went, offset, went)
+    
+    def _slice(self, start_date=None, end_date=None):
+        """期間に対応する配列の範囲 (配列の外側は切り詰める)"""
+        first = self._position(start_date) if start_date is not None else 0
+        last = self._position(end_date) + 1 if end_date is not None else self._capacity
+        return max(first, 0), min(max(last, 0), self._capacity)
+    
+    def dates(self, start_date=None, end_date=None):
+        first, last = self._slice(start_date, end_date)
+        return pd.DatetimeIndex(
+            (EPOCH + np.arange(self._start + first, self._start + last)).astype('datetime64[ns]'),
+            name='date'
+        )
+    
+    # ビット列
+    @staticmethod
+    def _unpack(bits, first=0, last=None):
+        unpacked = np.unpackbits(bits, bitorder='little').astype(bool)
+        return unpacked[first:last]
+    
+    @staticmethod
+    def _set_bits(bits, first, values):
+        unpacked = np.unpackbits(bits, bitorder='little')
+        unpacked[first:first + len(values)] = values
+        bits[:] = np.packbits(unpacked, bitorder='little')
+    
+    # 書き込み
+    def set_many(self, field, dates, values):
+        """
+        1項目をまとめて書き込む
+        
+        Args:
+            field: 'weight' / 'went_to_gym' / 'calories'
+            dates: 日付の配列
+            values: 値の配列
+        """
+        days = (pd.DatetimeIndex(dates).values.astype('datetime64[D]') - EPOCH).astype(int)
+        if len(days) == 0:
+            return
+        self._ensure(int(days.min()), int(days.max()))
+        positions = days - self._start
+        
+        if field == 'weight':
+            self._weight[positions] = np.asarray(values, dtype=np.float32)
+        elif field == 'calories':
+            calories = np.asarray(values, dtype=np.int64)
+            if calories.min() < 0 or calories.max() > np.iinfo(np.int16).max:
+                raise ValueError('消費カロリーは 0〜32767 で指定してください')
+            self._calories[positions] = calories
+        elif field == 'went_to_gym':
+            # 該当するビットだけを更新する
+            byte, bit = np.divmod(positions, 8)
+            mask = np.left_shift(1, bit).astype(np.uint8)
+            went = np.asarray(values, dtype=bool)
+            np.bitwise_or.at(self._gym_recorded, byte, mask)
+            np.bitwise_or.at(self._gym_went, byte[went], mask[went])
+            np.bitwise_and.at(self._gym_went, byte[~went], ~mask[~went])
+        else:
+            raise KeyError(field)
+    
+    def clear_many(self, field, dates):
+        """1項目をまとめて未記録に戻す (配列の外側の日付は無視する)"""
+        days = (pd.DatetimeIndex(dates).values.astype('datetime64[D]') - EPOCH).astype(int)
+        positions = days - self._start
+        positions = positions[(positions >= 0) & (positions < self._capacity)]
+        
+        if field == 'weight':
+            self._weight[positions] = np.nan
+        elif field == 'calories':
+            self._calories[positions] = CALORIES_MISSING
+        elif field == 'went_to_gym':
+            byte, bit = np.divmod(positions, 8)
+            mask = ~np.left_shift(1, bit).astype(np.uint8)
+            np.bitwise_and.at(self._gym_recorded, byte, mask)
+            np.bitwise_and.at(self._gym_went, byte, mask)
+        else:
+            raise KeyError(field)
+    
+    def set_record(self, date, record):
+        """1日分の記録 (フィールド名と値の辞書) を書き込む"""
+        for field, value in record.items():
+            self.set_many(field, [date], [value])
+    
+    # 読み込み
+    def get(self, date):
+        """1日分の記録 (未記録の項目は含めない)"""
+        position = self._position(date)
+        if not 0 <= position < self._capacity:
+            return {}
+        record = {}
+        if not np.isnan(self._weight[position]):
+            record['weight'] = round(float(self._weight[position]), 3)
+        byte, bit = divmod(position, 8)
+        if self._gym_recorded[byte] >> bit & 1:
+            record['went_to_gym'] = bool(self._gym_went[byte] >> bit & 1)
+        if self._calories[position] != CALORIES_MISSING:
+            record['calories'] = int(self._calories[position])
+        return record
+    
+    def weights(self, start_date=None, end_date=None):
+        """体重の float32 配列 (コピーしないビュー、未記録は NaN)"""
+        first, last = self._slice(start_date, end_date)
+        return self._weight[first:last]
+    
+    def calories(self, start_date=None, end_date=None):
+        """消費カロリーの int16 配列 (コピーしないビュー、未記録は -1)"""
+        first, last = self._slice(start_date, end_date)
+        return self._calories[first:last]
+    
+    def gym(self, start_date=None, end_date=None):
+        """(記録あり, 行った) の bool 配列の組"""
+        first, last = self._slice(start_date, end_date)
+        return (self._unpack(self._gym_recorded, first, last),
+                self._unpack(self._gym_went, first, last))
+    
+    def _values(self, field, start_date=None, end_date=None):
+        """(記録あり, 値) の配列の組"""
+        if field == 'weight':
+            values = self.weights(start_date, end_date)
+            return ~np.isnan(values), np.round(values.astype(np.float64), 3)
+        if field == 'calories':
+            values = self.calories(start_date, end_date)
+            return values != CALORIES_MISSING, values.astype(np.int64)
+        if field == 'went_to_gym':
+            return self.gym(start_date, end_date)
+        raise KeyError(field)
+    
+    def records(self, field, start_date=None, end_date=None):
+        """
+        記録のある日だけの DataFrame (get_*_data() と同じ date, 値の列)
+        """
+        recorded, values = self._values(field, start_date, end_date)
+        return pd.DataFrame({
+            'date': self.dates(start_date, end_date)[recorded],
+            field: values[recorded]
+        })
+    
+    def filled_weights(self, start_date=None, end_date=None, seed_weight=None):
+        """未記録日を前日の値で埋めた体重 (float64、seed_weight は期間の直前の体重)"""
+        values = np.round(self.weights(start_date, end_date).astype(np.float64), 3)
+        if seed_weight is not None and len(values) and np.isnan(values[0]):
+            values[0] = seed_weight
+        return forward_fill(values)
+    
+    def last_before(self, field, date):
+        """指定日より前の最後の値 (なければ None)"""
+        position = min(max(self._position(date), 0), self._capacity)
+        recorded, values = self._values(field)
+        indices = np.flatnonzero(recorded[:position])
+        return values[indices[-1]].item() if len(indices) else None
+    
+    def first_date(self, field):
+        """最初の記録日 (なければ None)"""
+        recorded, _ = self._values(field)
+        indices = np.flatnonzero(recorded)
+        if not len(indices):
+            return None
+        return pd.Timestamp(EPOCH + self._start + int(indices[0]))
+    
+    def frame(self, start_date=None, end_date=None):
+        """
+        HealthStorage.make_daily_frame() と同じ形の DataFrame
+        
+        体重は前方埋めせず、未記録の日も行として含む
+        """
+        recorded, went = self.gym(start_date, end_date)
+        calories = self.calories(start_date, end_date)
+        return pd.DataFrame({
+            'weight': np.round(self.weights(start_date, end_date).astype(np.float64), 3),
+            'went_to_gym': pd.arrays.BooleanArray(went, ~recorded),
+            'calories': np.where(calories == CALORIES_MISSING, np.nan, calories)
+        }, index=self.dates(start_date, end_date))
+    
+    # 差分同期の最終時刻
+    def synced_until(self, collection):
+        """コレクションの最終同期時刻 (UTC の Timestamp、未同期なら None)"""
+        value = int(self._synced[_COLLECTIONS.index(collection)])
+        return None if value == _NOT_SYNCED else pd.Timestamp(value, unit='us', tz='UTC')
+    
+    def set_synced_until(self, collection, timestamp):
+        # マイクロ秒未満は切り捨てる (>= で取得するので取りこぼさない)
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.tz_localize('UTC')
+        self._synced[_COLLECTIONS.index(collection)] = timestamp.value // 1000
@@ -1,12 +1,77 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
 import streamlit as st
-from datetime import datetime, timedelta
+import threading
+import os
+import time
 import pandas as pd
+from datetime import datetime
+from utils import perf
+from utils.daily_store import DailyStore
+from utils.snapshot_mirror import SnapshotMirror
+from utils.storage import HealthStorage, QueryCache, _secrets_section
 
-class FirebaseHandler:
-    def __init__(self):
-        if not firebase_admin._apps:
+
+def _value_size(value):
+    """Firestore の保存サイズの計算方法に沿ったフィールド値のバイト数"""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode()) + 1
+    if isinstance(value, dict):
+        return sum(len(key.encode()) + 1 + _value_size(v) for key, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_size(v) for v in value)
+    return 8
+
+
+def _document_size(doc_id, data):
+    """ドキュメント1件のおおよそのバイト数 (名前 + フィールド + 32 バイト)"""
+    return len(doc_id.encode()) + 1 + _value_size(data) + 32
+
+
+class _LockedStore:
+    """
+    差分同期の DailyStore を同期と同じロックの中で読む (SnapshotMirror と同じ読み込みメソッド)
+    
+    他のスレッドの同期で配列が拡張 (再マップ) されても、古い位置と新しい配列が混ざらない
+    """
+    
+    def __init__(self, store, lock):
+        self._store = store
+        self._lock = lock
+    
+    def records(self, field, start_date=None, end_date=None):
+        with self._lock:
+            return self._store.records(field, start_date, end_date)
+    
+    def last_before(self, field, date):
+        with self._lock:
+            return self._store.last_before(field, date)
+    
+    def first_date(self, field):
+        with self._lock:
+            return self._store.first_date(field)
+
+
+class FirebaseHandler(HealthStorage):
+    # 再実行やセッションをまたいで共有するキャッシュ
+    _cache = QueryCache()
+    
+    def __init__(self, sync_dir=None, collection_names=None, user_id=None, client=None,
+                 listen=None):
+        """
+        Args:
+            sync_dir: 差分同期の日次データファイルを置くディレクトリ (None の場合は secrets から)
+            collection_names: 論理名とコレクション名の対応 (一部だけ指定可)
+            user_id: ユーザー ID (指定すると users/{user_id}/ 以下を使う)
+            client: Firestore クライアント (ベンチマークなどで差し替える場合に指定)
+            listen: True の場合はリスナーで更新するメモリ上のコピーから読む
+                    (None の場合は secrets の realtime.listen)
+        """
+        if client is None and not firebase_admin._apps:
             # Streamlit Cloudの場合
             if 'firebase' in st.secrets:
                 cred = credentials.Certificate(dict(st.secrets['firebase']))
@@ -16,144 +81,336 @@ class FirebaseHandler:
             
             firebase_admin.initialize_app(cred)
         
-        self.db = firestore.client()
+        self.db = client if client is not None else firestore.client()
+        super().__init__(collection_names, user_id)
+        
+        # ローカルの日次データファイルによる差分同期 (secrets の local_sync.dir で有効化)
+        if sync_dir is None:
+            sync_dir = _secrets_section('local_sync').get('dir')
+        if sync_dir and user_id is not None:
+            # 日次データファイルもユーザーごとに分ける
+            sync_dir = os.path.join(sync_dir, self.USERS_COLLECTION, user_id)
+        self.sync_dir = sync_dir
+        self._store = None
+        self._sync_lock = threading.Lock()
+        
+        # on_snapshot リスナーによるメモリ上のコピー
+        self._mirror = None
+        if listen is None:
+            listen = _secrets_section('realtime').get('listen', False)
+        if listen:
+            self.start_listening()
+    
+    def _collection(self, collection):
+        return self.db.collection(self.collection_names[collection])
+    
+    # 読み込み (件数・バイト数・時間を計測)
+    def _get_document(self, collection, name):
+        if self._mirror is not None and self._mirror.ready(collection):
+            return self._mirror.document(collection, name)
+        
+        with perf.timed('firestore.get', collection=collection) as span:
+            doc = self._collection(collection).document(name).get()
+            data = doc.to_dict() if doc.exists else None
+            span.add(docs=1, bytes=_document_size(name, data) if data is not None else 0)
+        return data
+    
+    def _stream(self, collection, query):
+        """クエリの結果を (ドキュメント ID, データ) のリストで返す"""
+        with perf.timed('firestore.query', collection=collection) as span:
+            docs = [(doc.id, doc.to_dict()) for doc in query.stream()]
+            # 結果が0件でも1件分の読み込みとして課金される
+            span.add(docs=max(len(docs), 1),
+                     bytes=sum(_document_size(doc_id, data) for doc_id, data in docs))
+        return docs
     
     # ユーザー設定
-    def get_user_settings(self):
-        doc = self.db.collection('settings').document('user_config').get()
-        if doc.exists:
-            return doc.to_dict()
-        else:
-            # デフォルト設定
-            default_settings = {
-                'password': 'yasu0122',
-                'calorie_goal': 2000,
-                'weight_goal': 70.0
-            }
-            self.db.collection('settings').document('user_config').set(default_settings)
-            return default_settings
+    def _read_settings(self):
+        return self._get_document('settings', 'user_config')
     
-    def update_user_settings(self, settings):
-        self.db.collection('settings').document('user_config').set(settings)
+    def _write_settings(self, settings):
+        self._collection('settings').document('user_config').set(settings)
+        self._mirror_write('settings', 'user_config', settings)
     
-    # 体重データ
-    def save_weight(self, date, weight):
-        date_str = date.strftime('%Y-%m-%d')
-        self.db.collection('weight').document(date_str).set({
-            'date': date_str,
-            'weight': weight,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        }, merge=True)
+    # サマリー
+    def _read_summary(self, name):
+        return self._get_document('summary', name)
     
-    def get_weight_data(self, start_date=None, end_date=None):
-        query = self.db.collection('weight').order_by('date')
-        
-        if start_date:
-            query = query.where('date', '>=', start_date.strftime('%Y-%m-%d'))
-        if end_date:
-            query = query.where('date', '<=', end_date.strftime('%Y-%m-%d'))
-        
-        docs = query.stream()
-        data = [{'date': doc.id, 'weight': doc.to_dict()['weight']} for doc in docs]
+    def _write_summary(self, name, summary):
+        self._collection('summary').document(name).set(summary)
+        self._mirror_write('summary', name, summary)
+    
+    # 日次データ
+    def _write_daily_record(self, date_str, record, update_summaries=None):
+        """
+        1日分の記録とサマリーを1つのトランザクションでコミット
         
-        if not data:
-            return pd.DataFrame(columns=['date', 'weight'])
+        サマリーはメモリ上のコピーではなくトランザクション内で Firestore から読むため、
+        他の端末と同時に保存した場合は Firestore が競合を検出し、読み直してやり直す
+        """
+        summary_collection = self._collection('summary')
         
-        df = pd.DataFrame(data)
-        df['date'] = pd.to_datetime(df['date'])
-        df = df.sort_values('date')
+        @firestore.transactional
+        def commit(transaction):
+            summaries = {}
+            if update_summaries is not None:
+                summaries = update_summaries(
+                    lambda name: self._read_summary_in(transaction, name)
+                )
+            self._set_daily_record(transaction, date_str, record)
+            for name, summary in summaries.items():
+                transaction.set(summary_collection.document(name), summary)
+            return summaries
         
-        # 未入力日を前日の値で埋める
-        df = self._fill_missing_dates(df)
+        with perf.timed('firestore.commit') as span:
+            summaries = commit(self.db.transaction())
+            span.add(writes=len(record) + len(summaries))
         
-        return df
+        self._mirror_daily_record(date_str, record)
+        for name, summary in summaries.items():
+            self._mirror_write('summary', name, summary)
+        return summaries
     
-    def _fill_missing_dates(self, df):
-        if df.empty:
-            return df
+    def _read_summary_in(self, transaction, name):
+        with perf.timed('firestore.get', collection='summary') as span:
+            doc = self._collection('summary').document(name).get(transaction=transaction)
+            data = doc.to_dict() if doc.exists else None
+            span.add(docs=1, bytes=_document_size(name, data) if data is not None else 0)
+        return data
+    
+    def _write_daily_records(self, records):
+        """複数日の記録を1つの WriteBatch でコミット"""
+        batch = self.db.batch()
+        for date_str, record in records:
+            self._set_daily_record(batch, date_str, record)
         
-        # 日付範囲を作成
-        date_range = pd.date_range(start=df['date'].min(), end=datetime.now().date(), freq='D')
-        full_df = pd.DataFrame({'date': date_range})
+        with perf.timed('firestore.commit') as span:
+            batch.commit()
+            span.add(writes=sum(len(record) for _, record in records))
         
-        # マージして前方埋め
-        merged = full_df.merge(df, on='date', how='left')
-        merged['weight'] = merged['weight'].ffill()
+        for date_str, record in records:
+            self._mirror_daily_record(date_str, record)
+    
+    def _set_daily_record(self, batch, date_str, record):
+        for collection, field in self.DATA_FIELDS.items():
+            if field in record:
+                batch.set(self._collection(collection).document(date_str), {
+                    'date': date_str,
+                    field: record[field],
+                    'timestamp': firestore.SERVER_TIMESTAMP
+                }, merge=True)
+    
+    def _local_store(self, collection):
+        """
+        Firestore を読まずに使える日次データ (メモリ上のコピー、差分同期の日次データファイル)
         
-        return merged.dropna()
+        どちらも使えなければ None
+        """
+        if self._mirror is not None and self._mirror.ready(collection):
+            return self._mirror
+        if self.sync_dir:
+            return _LockedStore(self.sync_collection(collection), self._sync_lock)
+        return None
     
-    # ジムデータ
-    def save_gym_record(self, date, went_to_gym):
-        date_str = date.strftime('%Y-%m-%d')
-        self.db.collection('gym').document(date_str).set({
-            'date': date_str,
-            'went_to_gym': went_to_gym,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        }, merge=True)
+    def _query_collection(self, collection, field, start_date=None, end_date=None):
+        """コレクションを日付順に取得して DataFrame を返す"""
+        store = self._local_store(collection) if collection in self.DATA_FIELDS else None
+        if store is not None:
+            return store.records(field, start_date, end_date)
+        
+        return super()._query_collection(collection, field, start_date, end_date)
     
-    def get_gym_data(self, start_date=None, end_date=None):
-        query = self.db.collection('gym').order_by('date')
+    def iter_collection_chunks(self, collection, field, start_date=None, end_date=None,
+                               chunk_size=500):
+        """
+        日付範囲のドキュメントをカーソルページングで取得し、DataFrame のチャンクを順に返す
+        
+        Args:
+            collection: コレクション名
+            field: 値のフィールド名
+            start_date: 開始日 (None の場合は最初から)
+            end_date: 終了日 (None の場合は最後まで)
+            chunk_size: 1回のクエリで取得する最大件数
+        
+        Yields:
+            date, 値の列を持つ日付順の DataFrame
+        """
+        query = self._collection(collection).order_by('date')
         
         if start_date:
             query = query.where('date', '>=', start_date.strftime('%Y-%m-%d'))
         if end_date:
             query = query.where('date', '<=', end_date.strftime('%Y-%m-%d'))
         
-        docs = query.stream()
-        data = [{'date': doc.id, 'went_to_gym': doc.to_dict()['went_to_gym']} for doc in docs]
-        
-        if not data:
-            return pd.DataFrame(columns=['date', 'went_to_gym'])
-        
-        df = pd.DataFrame(data)
-        df['date'] = pd.to_datetime(df['date'])
-        return df.sort_values('date')
-    
-    # カロリーデータ
-    def save_calorie_record(self, date, calories):
-        date_str = date.strftime('%Y-%m-%d')
-        self.db.collection('calories').document(date_str).set({
-            'date': date_str,
-            'calories': calories,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        }, merge=True)
+        last_date = None
+        while True:
+            page = query.limit(chunk_size)
+            if last_date is not None:
+                page = page.start_after({'date': last_date})
+            
+            data = [
+                {'date': doc_id, field: doc[field]}
+                for doc_id, doc in self._stream(collection, page)
+            ]
+            if not data:
+                return
+            
+            df = pd.DataFrame(data)
+            df['date'] = pd.to_datetime(df['date'])
+            yield df
+            
+            if len(data) < chunk_size:
+                return
+            last_date = data[-1]['date']
     
-    def get_calorie_data(self, start_date=None, end_date=None):
-        query = self.db.collection('calories').order_by('date')
+    def _aggregate(self, collection, field, start_date, end_date, value):
+        """
+        Firestore の集計クエリ (count / sum / avg) で求める
         
+        ドキュメントを読まずに 1000 件ごとに1回分の読み込みで済む。
+        value で絞り込む場合は (値, date) の複合インデックスが必要
+        """
+        query = self._collection(collection)
         if start_date:
             query = query.where('date', '>=', start_date.strftime('%Y-%m-%d'))
         if end_date:
             query = query.where('date', '<=', end_date.strftime('%Y-%m-%d'))
+        if value is not None:
+            query = query.where(field, '==', value)
+        
+        # メモリ上のコピーや差分同期があればそのデータで、集計クエリのないクライアント
+        # (ベンチマークの FakeFirestore など) は読み込んだ記録で集計する
+        if self._local_store(collection) is not None or not hasattr(query, 'count'):
+            return super()._aggregate(collection, field, start_date, end_date, value)
         
-        docs = query.stream()
-        data = [{'date': doc.id, 'calories': doc.to_dict()['calories']} for doc in docs]
+        aggregation = query.count(alias='count')
+        if field != 'went_to_gym':
+            aggregation = aggregation.sum(field, alias='sum').avg(field, alias='avg')
+        with perf.timed('firestore.aggregate', collection=collection) as span:
+            results = {
+                result.alias: result.value
+                for results in aggregation.get() for result in results
+            }
+            span.add(docs=max(-(-int(results['count']) // 1000), 1))
+        return {
+            'count': int(results['count']),
+            'sum': results.get('sum') or 0,
+            'avg': results.get('avg')
+        }
+    
+    def _get_weight_before(self, date):
+        """指定日より前の最後の体重 (なければ None)"""
+        date_str = date.strftime('%Y-%m-%d')
         
-        if not data:
-            return pd.DataFrame(columns=['date', 'calories'])
+        store = self._local_store('weight')
+        if store is not None:
+            return store.last_before('weight', date)
         
-        df = pd.DataFrame(data)
-        df['date'] = pd.to_datetime(df['date'])
-        return df.sort_values('date')
+        docs = self._stream(
+            'weight',
+            self._collection('weight')
+            .where('date', '<', date_str)
+            .order_by('date', direction=firestore.Query.DESCENDING)
+            .limit(1)
+        )
+        return docs[0][1]['weight'] if docs else None
     
-    # 連続ジム日数計算
-    def calculate_consecutive_gym_days(self):
-        gym_df = self.get_gym_data()
+    def _first_record_date(self, collection):
+        store = self._local_store(collection)
+        if store is not None:
+            return store.first_date(self.DATA_FIELDS[collection])
         
-        if gym_df.empty:
-            return 0
+        docs = self._stream(collection, self._collection(collection).order_by('date').limit(1))
+        return pd.Timestamp(docs[0][0]) if docs else None
+    
+    # リスナーによるメモリ上のコピー
+    def start_listening(self, timeout=10):
+        """
+        日次データ・設定・サマリーのリスナーを開始し、以降はメモリ上のコピーから読む
         
-        gym_df = gym_df.sort_values('date', ascending=False)
-        consecutive = 0
-        current_date = datetime.now().date()
+        最初のスナップショット (全ドキュメント) を timeout 秒まで待つ。
+        まだ届いていないコレクションは届くまで Firestore から読む
         
-        for _, row in gym_df.iterrows():
-            row_date = row['date'].date()
-            
-            # 連続性をチェック
-            if (current_date - row_date).days == consecutive and row['went_to_gym']:
-                consecutive += 1
-            else:
-                break
+        Returns:
+            リスナーを開始したか (on_snapshot のないクライアントでは False)
+        """
+        if self._mirror is not None:
+            return True
+        if not hasattr(self._collection('weight'), 'on_snapshot'):
+            return False
         
-        return consecutive
+        mirror = SnapshotMirror(on_change=self._invalidate)
+        for collection, field in self.DATA_FIELDS.items():
+            mirror.watch(collection, self._collection(collection), field)
+        for collection in ('settings', 'summary'):
+            mirror.watch(collection, self._collection(collection))
+        self._mirror = mirror
+        
+        deadline = time.monotonic() + timeout
+        for collection in list(self.DATA_FIELDS) + ['settings', 'summary']:
+            mirror.ready(collection, max(deadline - time.monotonic(), 0))
+        return True
+    
+    def stop_listening(self):
+        if self._mirror is not None:
+            self._mirror.close()
+            self._mirror = None
+    
+    def is_listening(self):
+        return self._mirror is not None
+    
+    def _mirror_write(self, collection, doc_id, data):
+        """自分の書き込みをリスナーより先にメモリ上のコピーに反映"""
+        if self._mirror is not None:
+            self._mirror.set_document(collection, doc_id, data, notify=False)
+    
+    def _mirror_daily_record(self, date_str, record):
+        for collection, field in self.DATA_FIELDS.items():
+            if field in record:
+                self._mirror_write(collection, date_str, {field: record[field]})
+    
+    # 差分同期
+    def _daily_store(self):
+        """日次データファイルを開く (初回だけ)"""
+        if self._store is None:
+            # ディレクトリは実際に同期するときに作る (ログイン前の照合では作らない)
+            os.makedirs(self.sync_dir, exist_ok=True)
+            self._store = DailyStore(os.path.join(self.sync_dir, 'daily.store'))
+        return self._store
+    
+    def sync_collection(self, collection):
+        """
+        最終同期時刻 (timestamp の最大値) 以降に更新されたドキュメントだけを取得し、
+        ローカルの日次データファイル (utils.daily_store.DailyStore) に書き込む
+        
+        Args:
+            collection: 'weight' / 'gym' / 'calories'
+        
+        Returns:
+            DailyStore
+        """
+        field = self.DATA_FIELDS[collection]
+        
+        with self._sync_lock:
+            store = self._daily_store()
+            synced_until = store.synced_until(collection)
+            
+            query = self._collection(collection)
+            if synced_until is not None:
+                # 同時刻の書き込みを取りこぼさないよう >= で取得する (同じ日は上書き)
+                query = query.where('timestamp', '>=', synced_until.to_pydatetime())
+            
+            docs = [
+                (doc_id, data) for doc_id, data in self._stream(collection, query)
+                if data.get(field) is not None
+            ]
+            if not docs:
+                return store
+            
+            store.set_many(field, [doc_id for doc_id, _ in docs],
+                           [data[field] for _, data in docs])
+            timestamps = [data['timestamp'] for _, data in docs if data.get('timestamp')]
+            if timestamps:
+                store.set_synced_until(collection, max(timestamps))
+            store.flush()
+            return store
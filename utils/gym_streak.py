@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+
+
+def empty_streak_summary():
+    """記録がない場合の連続記録サマリー"""
+    return {
+        'current_streak': 0,
+        'current_start': None,
+        'last_gym_date': None,
+        'longest_streak': 0,
+        'history': []
+    }
+
+
+def _with_totals(history):
+    """連続記録の履歴から現在・最長の値を付けたサマリーを作成"""
+    if not history:
+        return empty_streak_summary()
+    
+    last = history[-1]
+    return {
+        'current_streak': last['days'],
+        'current_start': last['start'],
+        'last_gym_date': last['end'],
+        'longest_streak': max(run['days'] for run in history),
+        'history': history
+    }
+
+
+def compute_streak_summary(gym_df):
+    """
+    ジム記録全体から連続記録サマリーを計算 (修復・バックフィル用)
+    
+    未記録日と「行かなかった」日はどちらも連続を途切れさせる
+    
+    Args:
+        gym_df: date, went_to_gym 列を持つ DataFrame
+    
+    Returns:
+        連続記録サマリー (history は古い順の連続区間のリスト)
+    """
+    if gym_df.empty:
+        return empty_streak_summary()
+    
+    went = (gym_df.assign(went_to_gym=gym_df['went_to_gym'].astype(bool))
+            .groupby('date')['went_to_gym'].any())
+    went = went.reindex(pd.date_range(went.index.min(), went.index.max(), freq='D'),
+                        fill_value=False)
+    flags = went.to_numpy(dtype=bool)
+    
+    if not flags.any():
+        return empty_streak_summary()
+    
+    # False→True に変わる位置で区間番号を進める
+    starts = flags & ~np.concatenate(([False], flags[:-1]))
+    run_ids = np.cumsum(starts)[flags]
+    gym_dates = went.index[flags]
+    
+    runs = pd.Series(gym_dates).groupby(run_ids).agg(['min', 'max', 'size'])
+    history = [
+        {
+            'start': start.strftime('%Y-%m-%d'),
+            'end': end.strftime('%Y-%m-%d'),
+            'days': int(days)
+        }
+        for start, end, days in runs.itertuples(index=False)
+    ]
+    return _with_totals(history)
+
+
+def apply_gym_record(summary, date_str, went_to_gym):
+    """
+    1件のジム記録をサマリーに反映 (O(1))
+    
+    最新の連続区間以降への追記だけを差分更新し、過去日の修正など
+    差分では扱えない場合は None を返す (全体再計算が必要)
+    
+    Args:
+        summary: 現在の連続記録サマリー
+        date_str: 記録日 ('YYYY-MM-DD')
+        went_to_gym: ジムに行ったか
+    
+    Returns:
+        更新後のサマリー、または None
+    """
+    history = [dict(run) for run in summary.get('history', [])]
+    last = history[-1] if history else None
+    date = datetime.strptime(date_str, '%Y-%m-%d').date()
+    last_end = datetime.strptime(last['end'], '%Y-%m-%d').date() if last else None
+    
+    if not went_to_gym:
+        # 最新の区間より後の「行かなかった」記録は連続に影響しない
+        if last is None or date > last_end:
+            return _with_totals(history)
+        return None
+    
+    if last is not None and date == last_end:
+        return _with_totals(history)
+    
+    if last is not None and date == last_end + timedelta(days=1):
+        last['end'] = date_str
+        last['days'] += 1
+    elif last is None or date > last_end:
+        history.append({'start': date_str, 'end': date_str, 'days': 1})
+    else:
+        return None
+    
+    return _with_totals(history)
+
+
+def current_streak(summary, today=None):
+    """今日まで続いている連続日数 (今日の記録がなければ 0)"""
+    today = today or datetime.now().date()
+    if summary.get('last_gym_date') != today.strftime('%Y-%m-%d'):
+        return 0
+    return summary.get('current_streak', 0)
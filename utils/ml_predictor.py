@@ -1,52 +1,160 @@
+import copy
 import pandas as pd
-import numpy as np
-from sklearn.linear_model import LinearRegression
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from utils.recipe_searcher import RecipeSearcher
+from utils.weight_trend import WeightTrend
+from utils.rolling_stats import window_stats
+from utils.backtest import backtest, best_model, forecast
+from utils.storage import QueryCache
+from utils import perf
+
+# レシピ検索を画面描画と並行して行う共有スレッドプール
+_recipe_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='recipe-search')
+
+# レシピ検索を待つ最大秒数 (超えたらフォールバックのレシピを表示)
+RECIPE_TIMEOUT = 1.5
+
+# アドバイス・予測のメモ (データの版と日付ごと、全セッションで共有)。
+# リスナーを使わない構成では他の端末の書き込みに気付けないため、
+# クエリキャッシュと同じ時間で破棄する
+_memo = QueryCache(ttl=300, max_entries=256)
 
 class HealthPredictor:
-    def __init__(self, weight_df, gym_df, calorie_df):
-        self.weight_df = weight_df
-        self.gym_df = gym_df
-        self.calorie_df = calorie_df
+    def __init__(self, daily_df, history_days=None, trend=None, rolling_stats=None,
+                 data_key=None):
+        """
+        Args:
+            daily_df: FirebaseHandler.get_daily_frame() の日付インデックス DataFrame
+            history_days: 記録開始からの日数 (daily_df が期間で絞り込まれている場合に指定)
+            trend: 保存済みの WeightTrend (None の場合は daily_df の体重から作成)
+            rolling_stats: get_rolling_stats() の期間集計サマリー
+                (指定するとアドバイスは daily_df を使わずにこれから計算)
+            data_key: 元データの版 (HealthStorage.data_key())。指定するとデータが
+                変わるか日付が変わるまでアドバイス・予測の結果を使い回す
+        """
+        self.daily_df = daily_df
+        self.trend = trend
+        self.rolling_stats = rolling_stats
+        self.weight_df = daily_df['weight'].dropna().rename_axis('date').reset_index()
+        self.history_days = history_days if history_days is not None else len(self.weight_df)
         self.recipe_searcher = RecipeSearcher()
+        
+        # 同じ版でも表示期間で daily_df の範囲が変わるため、範囲もキーに含める
+        self._memo_key = None
+        if data_key is not None:
+            first_date = daily_df.index[0].isoformat() if len(daily_df) else None
+            self._memo_key = (data_key, datetime.now().date().isoformat(),
+                              first_date, len(daily_df), self.history_days)
+    
+    def _memo_get(self, name, args=()):
+        if self._memo_key is None:
+            return None
+        return _memo.get((self._memo_key, name, args))
+    
+    def _memo_set(self, name, value, args=()):
+        if self._memo_key is not None and value is not None:
+            _memo.set((self._memo_key, name, args), value)
+    
+    def _memoized(self, name, compute, *args):
+        """data_key が指定されていれば結果をメモから返す (なければ計算して保存)"""
+        value = self._memo_get(name, args)
+        if value is None:
+            value = compute(*args)
+            self._memo_set(name, value, args)
+        return value
     
     def can_predict(self):
         """30日以上のデータがあるか確認"""
-        return len(self.weight_df) >= 30
+        return self.history_days >= 30
     
+    @perf.traced('predictor.get_daily_advice')
     def get_daily_advice(self):
         """毎日のアドバイスを生成"""
+        advice = self._memoized('advice', self._compute_advice)
+        if 'recipe_inputs' not in advice:
+            return advice
+        
+        # 前回の検索結果があれば使い、なければ裏で検索する (結果は wait_for_recipes() で受け取る)
+        recipes = self._memo_get('recipes')
+        if recipes is not None:
+            return dict(advice, recipes=recipes, recipes_future=None)
+        
+        recipe_future = perf.submit(
+            _recipe_executor,
+            self.recipe_searcher.get_recipe_recommendations,
+            *advice['recipe_inputs']
+        )
+        return dict(advice, recipes=None, recipes_future=recipe_future)
+    
+    def _compute_advice(self):
         if not self.can_predict():
             return {
                 'advice': "📊 30日分のデータが溜まると、AIがあなたに最適なアドバイスを提供します!",
-                'recipes': None
+                'recipes': None,
+                'recipes_future': None
             }
         
+        if self.rolling_stats is not None:
+            # 書き込み時に集計済みの直近7日間の値を使う
+            stats = window_stats(self.rolling_stats, 7)
+            weight_trend = stats['weight_trend']
+            gym_rate = stats['gym_rate']
+            avg_calories = stats['avg_calories']
+        else:
+            weight_trend, gym_rate, avg_calories = self._recent_stats()
+        
+        # アドバイス生成
+        return {
+            'advice': self._generate_advice(weight_trend, gym_rate, avg_calories),
+            'recipe_inputs': (weight_trend, gym_rate, avg_calories)
+        }
+    
+    def _recent_stats(self):
+        """daily_df から直近7日間の体重トレンド・ジム頻度・平均カロリーを計算"""
         # 最近7日間の傾向分析
         recent_data = self.weight_df.tail(7)
         weight_trend = recent_data['weight'].diff().mean()
         
+        # 直近7日間の行 (未記録日は欠損値)
+        recent_days = self.daily_df.tail(7)
+        
         # ジム頻度
-        recent_gym = self.gym_df.tail(7)
-        gym_rate = recent_gym['went_to_gym'].sum() / 7 if not recent_gym.empty else 0
+        gym_rate = recent_days['went_to_gym'].fillna(False).sum() / 7
         
         # カロリー平均
-        recent_calories = self.calorie_df.tail(7)
-        avg_calories = recent_calories['calories'].mean() if not recent_calories.empty else 0
+        avg_calories = recent_days['calories'].mean()
+        if pd.isna(avg_calories):
+            avg_calories = 0
         
-        # アドバイス生成
-        advice = self._generate_advice(weight_trend, gym_rate, avg_calories)
+        return weight_trend, gym_rate, avg_calories
+    
+    @perf.traced('predictor.wait_for_recipes')
+    def wait_for_recipes(self, result, timeout=RECIPE_TIMEOUT):
+        """
+        get_daily_advice() のレシピ検索結果を待つ
         
-        # レシピ推奨
-        recipe_recommendations = self.recipe_searcher.get_recipe_recommendations(
-            weight_trend, gym_rate, avg_calories
-        )
+        Args:
+            result: get_daily_advice() の戻り値
+            timeout: 待つ最大秒数
         
-        return {
-            'advice': advice,
-            'recipes': recipe_recommendations
-        }
+        Returns:
+            推奨レシピ情報 (時間切れ・エラー時はフォールバック、対象外なら None)
+        """
+        future = result.get('recipes_future')
+        if future is None:
+            return result.get('recipes')
+        
+        try:
+            recipes = future.result(timeout=timeout)
+        except Exception:
+            # 時間切れでも検索は続き、結果はレシピキャッシュに残る (フォールバックはメモしない)
+            return self.recipe_searcher.get_fallback_recommendations(*result['recipe_inputs'])
+        
+        # 検索エラー時のフォールバックはメモせず、次回また検索する
+        if not recipes.get('error'):
+            self._memo_set('recipes', recipes)
+        return recipes
     
     def _generate_advice(self, weight_trend, gym_rate, avg_calories):
         """アドバイス生成ロジック"""
@@ -74,26 +182,68 @@ class HealthPredictor:
         
         return "\n\n".join(advice_parts)
     
+    @perf.traced('predictor.predict_future_weight')
     def predict_future_weight(self, days=7):
         """将来の体重予測"""
+        return self._memoized('predict_future_weight', self._predict_future_weight, days)
+    
+    def _predict_future_weight(self, days):
         if not self.can_predict():
             return None
         
-        # 日付を数値に変換
-        self.weight_df['days_since_start'] = (
-            self.weight_df['date'] - self.weight_df['date'].min()
-        ).dt.days
-        
-        X = self.weight_df['days_since_start'].values.reshape(-1, 1)
-        y = self.weight_df['weight'].values
+        # 十分統計量から線形トレンドを求める (weight_df・保存済みのトレンドは変更しない)
+        if self.trend is not None:
+            trend = copy.deepcopy(self.trend)
+        else:
+            trend = WeightTrend.from_series(self.weight_df['date'], self.weight_df['weight'])
         
-        # 線形回帰モデル
-        model = LinearRegression()
-        model.fit(X, y)
+        # 最後の記録日から今日までを前日の体重で埋め、明日からを予測する
+        # (daily_df の体重と同じく今日まで埋めた点で回帰する)
+        trend.fill_to(datetime.now().date())
         
         # 未来の予測
-        last_day = self.weight_df['days_since_start'].max()
-        future_days = np.array([last_day + i for i in range(1, days + 1)]).reshape(-1, 1)
-        predictions = model.predict(future_days)
+        return trend.predict_days_ahead(days)
+    
+    @perf.traced('predictor.predict_weight_interval')
+    def predict_weight_interval(self, days=7, window=30):
+        """
+        バックテストで最も誤差の小さいモデルを選び、予測区間付きで体重を予測
         
-        return predictions
+        Args:
+            days: 何日先まで予測するか
+            window: 予測に使う直近の日数
+        
+        Returns:
+            {'model': モデル名, 'report': 評価結果,
+             'forecast': date, prediction, lower, upper 列の DataFrame (80%区間)}
+            データが足りない場合は None
+        """
+        return self._memoized('predict_weight_interval', self._predict_weight_interval,
+                              days, window)
+    
+    def _predict_weight_interval(self, days, window):
+        if not self.can_predict():
+            return None
+        
+        weights = self.weight_df['weight'].to_numpy()
+        report = backtest(weights, window=window, horizon=days)
+        if report.empty:
+            return None
+        
+        model = best_model(report)
+        prediction = forecast(weights, model, window=window, horizon=days)
+        errors = report.loc[model]
+        future_dates = pd.date_range(
+            self.weight_df['date'].max() + timedelta(days=1), periods=days, freq='D'
+        )
+        
+        return {
+            'model': model,
+            'report': report,
+            'forecast': pd.DataFrame({
+                'date': future_dates,
+                'prediction': prediction,
+                'lower': prediction + errors['q10'].to_numpy(),
+                'upper': prediction + errors['q90'].to_numpy()
+            })
+        }
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""
+処理時間・読み込み件数の計測
+
+ページの再実行 (rerun) ごとに run() で記録を開始し、計測したい処理を
+timed() / traced() で囲む。記録はプロセス全体の累計にも加算され、
+JSON Lines や Prometheus のテキスト形式で書き出せる
+
+    with perf.run('メイン画面') as recorder:
+        with perf.timed('firestore.query', collection='weight') as span:
+            docs = ...
+            span.add(docs=len(docs), bytes=size)
+"""
+import contextvars
+import functools
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# 直近の再実行を何件まで保持するか (p95 などの計算用)
+RUN_HISTORY = 500
+
+_current_run = contextvars.ContextVar('perf_run', default=None)
+
+
+class Span:
+    """1回の処理の所要時間と件数などのカウンタ"""
+    
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.duration_ms = 0.0
+        self.counters: Dict[str, float] = {}
+        self.error = None
+    
+    def add(self, **counters):
+        """件数・バイト数などを加算"""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'labels': self.labels,
+            'duration_ms': round(self.duration_ms, 3),
+            'counters': self.counters,
+            'error': self.error
+        }
+
+
+class RunRecorder:
+    """1回の再実行の間に記録された Span"""
+    
+    def __init__(self, name: str):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started = time.time()
+        self.total_ms: Optional[float] = None
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+    
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+    
+    def summary(self) -> List[Dict]:
+        """名前とラベルごとの回数・合計時間・カウンタ"""
+        rows = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            key = (span.name, tuple(sorted(span.labels.items())))
+            row = rows.setdefault(key, {
+                'name': span.name,
+                'labels': span.labels,
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0
+            })
+            row['count'] += 1
+            row['total_ms'] += span.duration_ms
+            row['max_ms'] = max(row['max_ms'], span.duration_ms)
+            for counter, value in span.counters.items():
+                row[counter] = row.get(counter, 0) + value
+        return sorted(rows.values(), key=lambda row: row['total_ms'], reverse=True)
+    
+    def totals(self) -> Dict[str, float]:
+        """全 Span のカウンタの合計"""
+        totals = {}
+        for row in self.summary():
+            for key, value in row.items():
+                if key not in ('name', 'labels', 'count', 'total_ms', 'max_ms'):
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+    
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            'run_id': self.run_id,
+            'name': self.name,
+            'started': self.started,
+            'total_ms': self.total_ms,
+            'spans': spans
+        }
+
+
+class _Registry:
+    """プロセス全体の累計と直近の再実行の記録"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[tuple, Dict[str, float]] = {}
+        self.runs = deque(maxlen=RUN_HISTORY)
+        # 再実行の所要時間の累計 (保持件数で切り捨てないので単調に増える)
+        self._run_seconds = 0.0
+        self._run_count = 0
+    
+    def record_span(self, span: Span):
+        key = (span.name, tuple(sorted(span.labels.items())))
+        with self._lock:
+            totals = self._totals.setdefault(key, {'calls': 0, 'seconds': 0.0, 'errors': 0})
+            totals['calls'] += 1
+            totals['seconds'] += span.duration_ms / 1000
+            totals['errors'] += span.error is not None
+            for counter, value in span.counters.items():
+                totals[counter] = totals.get(counter, 0) + value
+    
+    def record_run(self, recorder: RunRecorder):
+        with self._lock:
+            self.runs.append(recorder)
+            if recorder.total_ms is not None:
+                self._run_seconds += recorder.total_ms / 1000
+                self._run_count += 1
+    
+    def totals(self) -> Dict[tuple, Dict[str, float]]:
+        with self._lock:
+            return {key: dict(values) for key, values in self._totals.items()}
+    
+    def recent_runs(self) -> List[RunRecorder]:
+        with self._lock:
+            return list(self.runs)
+    
+    def run_totals(self) -> tuple:
+        """(再実行の所要時間の合計 [秒], 回数) のプロセス起動からの累計"""
+        with self._lock:
+            return self._run_seconds, self._run_count
+    
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self.runs.clear()
+            self._run_seconds = 0.0
+            self._run_count = 0
+
+
+registry = _Registry()
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """
+    with ブロックの所要時間を記録
+    
+    Args:
+        name: 処理名 ('firestore.query' など)
+        labels: 集計を分けるラベル (collection など)
+    
+    Yields:
+        Span (件数などは span.add() で加算する)
+    """
+    span = Span(name, {key: str(value) for key, value in labels.items()})
+    start = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        span.error = type(e).__name__
+        raise
+    finally:
+        span.duration_ms = (time.perf_counter() - start) * 1000
+        recorder = _current_run.get()
+        if recorder is not None:
+            recorder.add(span)
+        registry.record_span(span)
+
+
+def traced(name: str):
+    """関数全体の所要時間を記録するデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def run(name: str = 'page'):
+    """
+    1回の再実行の記録を開始
+    
+    Yields:
+        RunRecorder (ブロックを抜けると total_ms が入る)
+    """
+    recorder = RunRecorder(name)
+    token = _current_run.set(recorder)
+    start = time.perf_counter()
+    try:
+        yield recorder
+    finally:
+        recorder.total_ms = (time.perf_counter() - start) * 1000
+        _current_run.reset(token)
+        registry.record_run(recorder)
+
+
+def current_run() -> Optional[RunRecorder]:
+    return _current_run.get()
+
+
+def submit(executor, func, *args, **kwargs):
+    """
+    スレッドプールに処理を渡す (呼び出し元の再実行の記録を引き継ぐ)
+    
+    ThreadPoolExecutor は contextvars を引き継がないため、コンテキストを
+    コピーして実行する
+    """
+    context = contextvars.copy_context()
+    return executor.submit(context.run, func, *args, **kwargs)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+def render_latency(quantiles=(0.5, 0.95)) -> Dict[float, float]:
+    """直近の再実行の所要時間 (ms) の分位点"""
+    durations = [r.total_ms for r in registry.recent_runs() if r.total_ms is not None]
+    return {q: _percentile(durations, q) for q in quantiles}
+
+
+def to_jsonl(runs: Optional[List[RunRecorder]] = None) -> str:
+    """再実行ごとの記録を JSON Lines で返す (None の場合は保持している全件)"""
+    runs = registry.recent_runs() if runs is None else runs
+    return ''.join(
+        json.dumps(r.to_dict(), ensure_ascii=False, default=str) + '\n' for r in runs
+    )
+
+
+def _prometheus_labels(labels: Dict[str, str]) -> str:
+    def escape(value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items())) + '}'
+
+
+def to_prometheus(prefix: str = 'health_app') -> str:
+    """
+    累計値を Prometheus のテキスト形式で返す
+    
+    span ごとの呼び出し回数・秒数・エラー数・カウンタ (docs, bytes など) と、
+    直近の再実行の所要時間の分位点を出力する (_sum / _count は rate() で使えるよう全期間の累計)
+    """
+    metrics: Dict[str, List[str]] = {}
+    for (name, labels), values in registry.totals().items():
+        label_text = _prometheus_labels(dict(labels, span=name))
+        for key, value in values.items():
+            metric = f'{prefix}_span_{key}_total'
+            metrics.setdefault(metric, []).append(f'{metric}{label_text} {value}')
+    
+    lines = []
+    for metric, samples in sorted(metrics.items()):
+        lines.append(f'# TYPE {metric} counter')
+        lines.extend(samples)
+    
+    durations = [r.total_ms / 1000 for r in registry.recent_runs() if r.total_ms is not None]
+    metric = f'{prefix}_render_seconds'
+    lines.append(f'# TYPE {metric} summary')
+    for q in (0.5, 0.9, 0.95, 0.99):
+        lines.append(f'{metric}{{quantile="{q}"}} {_percentile(durations, q)}')
+    run_seconds, run_count = registry.run_totals()
+    lines.append(f'{metric}_sum {run_seconds}')
+    lines.append(f'{metric}_count {run_count}')
+    return '\n'.join(lines) + '\n'
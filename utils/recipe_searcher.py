@@ -1,13 +1,133 @@
 import streamlit as st
-from googleapiclient.discovery import build
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import json
+import os
+import time
+from utils import perf
+from utils.storage import _secrets_section
+
+
+class RecipeCache:
+    """
+    検索結果のキャッシュと API 利用回数の記録 (メモリ + JSON ファイル)
+    
+    ttl を過ぎた結果も stale_ttl までは古い結果として返し、裏で更新する
+    """
+    
+    def __init__(self, path: Optional[str] = None, ttl: int = 24 * 3600,
+                 stale_ttl: int = 7 * 24 * 3600, max_entries: int = 64,
+                 daily_quota: int = 90):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.daily_quota = daily_quota
+        self._entries = OrderedDict()
+        self._quota = {'date': None, 'count': 0}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._load()
+    
+    @staticmethod
+    def make_key(query: str, num_results: int) -> str:
+        return f"{num_results}:{query}"
+    
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self._entries = OrderedDict(data.get('entries', {}))
+            self._quota = data.get('quota', self._quota)
+        except (OSError, ValueError):
+            # 壊れたキャッシュは捨てて作り直す
+            self._entries = OrderedDict()
+    
+    def _save(self):
+        if not self.path:
+            return
+        data = {'entries': self._entries, 'quota': self._quota}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+    
+    def get(self, key: str) -> Optional[Tuple[List[Dict], bool]]:
+        """
+        Returns:
+            (レシピのリスト, 新しいか) 。期限切れ・未登録なら None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            age = time.time() - entry['fetched_at']
+            if age > self.stale_ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry['recipes'], age <= self.ttl
+    
+    def set(self, key: str, recipes: List[Dict]):
+        with self._lock:
+            self._entries[key] = {'recipes': recipes, 'fetched_at': time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+    
+    def _today(self) -> str:
+        return datetime.now().strftime('%Y-%m-%d')
+    
+    def try_consume_quota(self) -> bool:
+        """今日の上限に達していなければ API 呼び出しを1回分記録して True を返す"""
+        with self._lock:
+            if self._quota.get('date') != self._today():
+                self._quota = {'date': self._today(), 'count': 0}
+            if self._quota['count'] >= self.daily_quota:
+                return False
+            self._quota['count'] += 1
+            self._save()
+            return True
+    
+    def quota_used(self) -> int:
+        with self._lock:
+            if self._quota.get('date') != self._today():
+                return 0
+            return self._quota['count']
+    
+    def start_refresh(self, key: str) -> bool:
+        """同じキーの更新が実行中でなければ True (更新の重複を防ぐ)"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+    
+    def finish_refresh(self, key: str):
+        with self._lock:
+            self._refreshing.discard(key)
+
 
 class RecipeSearcher:
+    # プロセス内で共有する検索キャッシュ
+    _cache = None
+    _cache_lock = threading.Lock()
+    
     def __init__(self):
-        if 'google_search' in st.secrets:
-            self.api_key = st.secrets['google_search']['api_key']
-            self.search_engine_id = st.secrets['google_search']['search_engine_id']
+        config = _secrets_section('google_search')
+        if config:
+            self.api_key = config['api_key']
+            self.search_engine_id = config['search_engine_id']
+            cache_path = config.get('cache_path', '.recipe_cache.json')
             try:
+                # Google API クライアントは API キーがある場合だけ読み込む
+                from googleapiclient.discovery import build
+                
                 self.service = build("customsearch", "v1", developerKey=self.api_key)
             except Exception as e:
                 st.warning(f"Google Search API初期化エラー: {str(e)}")
@@ -15,7 +135,14 @@ class RecipeSearcher:
         else:
             self.api_key = None
             self.service = None
+            cache_path = None
+        
+        with RecipeSearcher._cache_lock:
+            if RecipeSearcher._cache is None:
+                RecipeSearcher._cache = RecipeCache(cache_path)
+        self.cache = RecipeSearcher._cache
     
+    @perf.traced('recipe.search')
     def search_recipes(self, query: str, num_results: int = 5) -> List[Dict]:
         """
         レシピを検索
@@ -27,11 +154,43 @@ class RecipeSearcher:
         Returns:
             レシピ情報のリスト
         """
+        return self._search(query, num_results)[0]
+    
+    def _search(self, query: str, num_results: int) -> Tuple[List[Dict], Optional[str]]:
+        """
+        レシピを検索し、API エラーがあればそのメッセージも返す
+        
+        検索は別スレッドで実行されるため、ここでは st.warning を呼ばず
+        エラーの表示は呼び出し側 (スクリプトスレッド) に任せる
+        """
         if not self.service:
-            return self._get_fallback_recipes(query)
+            return self._get_fallback_recipes(query), None
+        
+        key = self.cache.make_key(query, num_results)
+        cached = self.cache.get(key)
+        
+        if cached is not None:
+            recipes, fresh = cached
+            if not fresh:
+                # 古い結果をすぐ返し、裏で更新する
+                self._refresh_in_background(key, query, num_results)
+            return recipes, None
+        
+        # 無料枠の上限に近づいたら API を呼ばない
+        if not self.cache.try_consume_quota():
+            return self._get_fallback_recipes(query), None
         
         try:
-            # Google Custom Search実行
+            recipes = self._fetch_recipes(query, num_results)
+            self.cache.set(key, recipes)
+            return recipes, None
+        
+        except Exception as e:
+            return self._get_fallback_recipes(query), f"検索エラー: {str(e)}"
+    
+    def _fetch_recipes(self, query: str, num_results: int) -> List[Dict]:
+        """Google Custom Search を実行して結果を整形"""
+        with perf.timed('recipe.api') as span:
             result = self.service.cse().list(
                 q=query,
                 cx=self.search_engine_id,
@@ -39,29 +198,44 @@ class RecipeSearcher:
                 lr='lang_ja',
                 safe='active'
             ).execute()
-            
-            recipes = []
-            
-            if 'items' in result:
-                for item in result['items']:
-                    recipe = {
-                        'title': item.get('title', ''),
-                        'url': item.get('link', ''),
-                        'snippet': item.get('snippet', ''),
-                        'source': self._extract_source(item.get('link', ''))
-                    }
-                    
-                    # サムネイル画像があれば追加
-                    if 'pagemap' in item and 'cse_image' in item['pagemap']:
-                        recipe['image'] = item['pagemap']['cse_image'][0].get('src', '')
-                    
-                    recipes.append(recipe)
-            
-            return recipes
+            span.add(api_calls=1, results=len(result.get('items', [])))
         
-        except Exception as e:
-            st.warning(f"検索エラー: {str(e)}")
-            return self._get_fallback_recipes(query)
+        recipes = []
+        
+        if 'items' in result:
+            for item in result['items']:
+                recipe = {
+                    'title': item.get('title', ''),
+                    'url': item.get('link', ''),
+                    'snippet': item.get('snippet', ''),
+                    'source': self._extract_source(item.get('link', ''))
+                }
+                
+                # サムネイル画像があれば追加
+                if 'pagemap' in item and 'cse_image' in item['pagemap']:
+                    recipe['image'] = item['pagemap']['cse_image'][0].get('src', '')
+                
+                recipes.append(recipe)
+        
+        return recipes
+    
+    def _refresh_in_background(self, key: str, query: str, num_results: int):
+        """期限切れのキャッシュを別スレッドで更新 (失敗時は古い結果を使い続ける)"""
+        if not self.cache.start_refresh(key):
+            return
+        if not self.cache.try_consume_quota():
+            self.cache.finish_refresh(key)
+            return
+        
+        def refresh():
+            try:
+                self.cache.set(key, self._fetch_recipes(query, num_results))
+            except Exception:
+                pass
+            finally:
+                self.cache.finish_refresh(key)
+        
+        threading.Thread(target=refresh, daemon=True).start()
     
     def _extract_source(self, url: str) -> str:
         """URLからサイト名を抽出"""
@@ -127,9 +301,32 @@ class RecipeSearcher:
             avg_calories: 平均消費カロリー
         
         Returns:
-            推奨レシピ情報
+            推奨レシピ情報 (検索に失敗した場合は 'error' にメッセージ)
         """
-        # 検索クエリの生成
+        query, category = self._select_query(weight_trend, gym_rate, avg_calories)
+        recipes, error = self._search(query, num_results=5)
+        
+        return {
+            'category': category,
+            'query': query,
+            'recipes': recipes,
+            'error': error
+        }
+    
+    def get_fallback_recommendations(self, weight_trend: float, gym_rate: float,
+                                     avg_calories: float) -> Dict:
+        """検索を待てない場合の推奨レシピ (ネットワークを使わない)"""
+        query, category = self._select_query(weight_trend, gym_rate, avg_calories)
+        
+        return {
+            'category': category,
+            'query': query,
+            'recipes': self._get_fallback_recipes(query)
+        }
+    
+    def _select_query(self, weight_trend: float, gym_rate: float,
+                      avg_calories: float) -> Tuple[str, str]:
+        """ユーザーの状態から検索クエリとカテゴリを決める"""
         if weight_trend > 0.2:
             query = "低カロリー 高タンパク ダイエット レシピ"
             category = "体重管理"
@@ -143,10 +340,4 @@ class RecipeSearcher:
             query = "バランス 健康 簡単 レシピ"
             category = "健康維持"
         
-        recipes = self.search_recipes(query, num_results=5)
-        
-        return {
-            'category': category,
-            'query': query,
-            'recipes': recipes
-        }
+        return query, category
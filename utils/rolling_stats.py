@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from utils.weight_trend import WeightTrend
+
+# 書き込み時に集計しておく期間 (日数)
+ROLLING_WINDOWS = (7, 30, 90)
+
+# サマリーに残す日数 (年表示の 366 日分を含める)
+RETENTION_DAYS = 400
+
+
+def empty_rolling_summary():
+    """記録がない場合の集計サマリー"""
+    return {
+        'as_of': None,
+        'seed_weight': None,
+        'days': {},
+        'windows': {}
+    }
+
+
+def _window_stats(days, seed_weight, start, end):
+    """start〜end (両端を含む) の集計値を日ごとの記録から計算"""
+    start_str, end_str = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    dates = sorted(days)
+    
+    # 期間初日の体重は直前の記録で埋める
+    first_weight = seed_weight
+    weight_dates, weights = [], []
+    gym_count = gym_recorded = 0
+    calorie_sum = calorie_count = 0
+    
+    for date_str in dates:
+        record = days[date_str]
+        if date_str < start_str:
+            if record.get('weight') is not None:
+                first_weight = record['weight']
+            continue
+        if date_str > end_str:
+            break
+        if record.get('weight') is not None:
+            weight_dates.append(date_str)
+            weights.append(record['weight'])
+        if record.get('went_to_gym') is not None:
+            gym_recorded += 1
+            gym_count += bool(record['went_to_gym'])
+        if record.get('calories') is not None:
+            calorie_sum += record['calories']
+            calorie_count += 1
+    
+    if weights and (first_weight is None or weight_dates[0] == start_str):
+        first_weight = weights[0]
+    last_weight = weights[-1] if weights else first_weight
+    
+    trend = WeightTrend.from_series(pd.to_datetime(weight_dates), weights)
+    return {
+        'start': start_str,
+        'end': end_str,
+        'weight_first': first_weight,
+        'weight_last': last_weight,
+        'weight_count': len(weights),
+        'weight_sums': trend.sums.tolist(),
+        'weight_origin': weight_dates[0] if weight_dates else None,
+        'gym_count': gym_count,
+        'gym_recorded': gym_recorded,
+        'calorie_sum': calorie_sum,
+        'calorie_count': calorie_count
+    }
+
+
+def _with_windows(summary, today):
+    """保持期間外の日を落とし、今日時点の各期間の集計を付け直す"""
+    cutoff = (today - timedelta(days=RETENTION_DAYS - 1)).strftime('%Y-%m-%d')
+    days = dict(summary['days'])
+    seed_weight = summary.get('seed_weight')
+    
+    for date_str in sorted(d for d in days if d < cutoff):
+        # 落とす日の体重は、期間の初日を埋めるための値として残す
+        if days[date_str].get('weight') is not None:
+            seed_weight = days[date_str]['weight']
+        del days[date_str]
+    
+    windows = {
+        str(window): _window_stats(days, seed_weight, today - timedelta(days=window - 1), today)
+        for window in ROLLING_WINDOWS
+    }
+    return {
+        'as_of': today.strftime('%Y-%m-%d'),
+        'seed_weight': seed_weight,
+        'days': days,
+        'windows': windows
+    }
+
+
+def apply_daily_record(summary, date_str, record, today=None):
+    """
+    1日分の記録をサマリーに反映
+    
+    保持する日数が一定なので、記録の総数によらず一定の計算量で済む
+    
+    Args:
+        summary: 現在の集計サマリー
+        date_str: 記録日 ('YYYY-MM-DD')
+        record: weight / went_to_gym / calories のうち保存した値
+        today: 集計の基準日 (None の場合は今日)
+    
+    Returns:
+        更新後のサマリー
+    """
+    today = today or datetime.now().date()
+    days = dict(summary.get('days', {}))
+    days[date_str] = dict(days.get(date_str, {}), **record)
+    return _with_windows(dict(summary, days=days), today)
+
+
+def compute_rolling_summary(daily_df, seed_weight=None, today=None):
+    """
+    日付インデックスの DataFrame から集計サマリーを作成 (修復・バックフィル用)
+    
+    Args:
+        daily_df: get_daily_frame() の戻り値 (保持期間分あればよい)
+        seed_weight: daily_df より前の最後の体重
+        today: 集計の基準日 (None の場合は今日)
+    """
+    today = today or datetime.now().date()
+    days = {}
+    for date, row in daily_df.iterrows():
+        record = {
+            field: (bool(row[field]) if field == 'went_to_gym' else float(row[field]))
+            for field in ('weight', 'went_to_gym', 'calories')
+            if pd.notna(row[field])
+        }
+        if record:
+            days[date.strftime('%Y-%m-%d')] = record
+    summary = dict(empty_rolling_summary(), seed_weight=seed_weight, days=days)
+    return _with_windows(summary, today)
+
+
+def window_stats(summary, days, today=None):
+    """
+    今日までの days 日間の指標
+    
+    書き込み時に集計済みの期間はそのまま使い、それ以外 (日付が変わった後や
+    任意の期間) は保持している日ごとの記録から計算する
+    
+    Returns:
+        current_weight, weight_change, weight_trend (1日あたりの平均変化),
+        weight_slope (回帰の傾き), gym_count, gym_rate, avg_calories
+    """
+    today = today or datetime.now().date()
+    stats = None
+    if summary.get('as_of') == today.strftime('%Y-%m-%d'):
+        stats = summary.get('windows', {}).get(str(days))
+    if stats is None:
+        stats = _window_stats(summary.get('days', {}), summary.get('seed_weight'),
+                              today - timedelta(days=days - 1), today)
+    
+    first, last = stats['weight_first'], stats['weight_last']
+    has_weight = first is not None and last is not None
+    trend = WeightTrend()
+    trend.sums = np.array(stats['weight_sums'], dtype=float)
+    
+    return {
+        'current_weight': last,
+        'weight_change': last - first if has_weight else None,
+        'weight_trend': (last - first) / (days - 1) if has_weight and days > 1 else 0.0,
+        'weight_slope': trend.coefficients()[0],
+        'gym_count': stats['gym_count'],
+        'gym_rate': stats['gym_count'] / days,
+        'avg_calories': (stats['calorie_sum'] / stats['calorie_count']
+                         if stats['calorie_count'] else 0)
+    }
@@ -0,0 +1,119 @@
+"""
+Firestore の on_snapshot リスナーで更新するコレクションのメモリ上のコピー
+
+FirebaseHandler ごとに1つ作り、st.cache_resource で全セッションが共有する。
+リスナーは最初に全ドキュメントを1回読み込み、以降は変更があったドキュメントだけを
+受け取るので、再実行ごとの読み込みは発生せず、他の端末からの書き込みも数秒で反映される
+"""
+import copy
+import threading
+from utils.daily_store import DailyStore
+
+
+class SnapshotMirror:
+    """
+    コレクションのメモリ上のコピー
+    
+    日次データは日付ごとの値を DailyStore (メモリ上) に、設定・サマリーは
+    ドキュメント ID ごとの辞書で持つ。リスナーのスレッドと読み込みが重ならないよう
+    全ての読み書きをロックして行う
+    
+    Args:
+        on_change: 変更を反映した後にコレクションの論理名を渡して呼ぶ関数
+    """
+    
+    def __init__(self, on_change=None):
+        self.store = DailyStore()
+        self.last_error = None
+        self._documents = {}
+        self._fields = {}
+        self._ready = {}
+        self._watches = []
+        self._lock = threading.RLock()
+        self._on_change = on_change
+    
+    def watch(self, name, reference, field=None):
+        """
+        コレクションのリスナーを開始
+        
+        Args:
+            name: 論理名 ('weight' / 'settings' など)
+            reference: コレクションの参照 (on_snapshot を持つもの)
+            field: 日次データの値のフィールド名 (None の場合はドキュメントをそのまま持つ)
+        """
+        self._fields[name] = field
+        self._ready[name] = threading.Event()
+        if field is None:
+            self._documents[name] = {}
+        self._watches.append(reference.on_snapshot(
+            lambda docs, changes, read_time: self._on_snapshot(name, changes)
+        ))
+    
+    def _on_snapshot(self, name, changes):
+        try:
+            with self._lock:
+                for change in changes:
+                    document = change.document
+                    data = document.to_dict() if change.type.name != 'REMOVED' else None
+                    self.set_document(name, document.id, data, notify=False)
+        except Exception as e:
+            # リスナーのスレッドを止めないよう記録だけしておく
+            self.last_error = e
+            return
+        self._ready[name].set()
+        if self._on_change:
+            self._on_change(name)
+    
+    def set_document(self, name, doc_id, data, notify=True):
+        """
+        ドキュメントを反映 (自分の書き込みをリスナーより先に反映する場合にも使う)
+        
+        Args:
+            name: 論理名
+            doc_id: ドキュメント ID (日次データは日付)
+            data: ドキュメントの内容 (None の場合は削除)
+            notify: True の場合は on_change を呼ぶ
+        """
+        if name not in self._fields:
+            return
+        field = self._fields[name]
+        with self._lock:
+            if field is None:
+                if data is None:
+                    self._documents[name].pop(doc_id, None)
+                else:
+                    self._documents[name][doc_id] = copy.deepcopy(data)
+            elif data is None or data.get(field) is None:
+                self.store.clear_many(field, [doc_id])
+            else:
+                self.store.set_many(field, [doc_id], [data[field]])
+        if notify and self._on_change:
+            self._on_change(name)
+    
+    def ready(self, name, timeout=0):
+        """最初のスナップショットを受け取ったか (timeout 秒まで待つ)"""
+        event = self._ready.get(name)
+        return event is not None and event.wait(timeout)
+    
+    # 読み込み (ロック中に取り出してコピーを返す)
+    def document(self, name, doc_id):
+        with self._lock:
+            return copy.deepcopy(self._documents[name].get(doc_id))
+    
+    def records(self, field, start_date=None, end_date=None):
+        with self._lock:
+            return self.store.records(field, start_date, end_date)
+    
+    def last_before(self, field, date):
+        with self._lock:
+            return self.store.last_before(field, date)
+    
+    def first_date(self, field):
+        with self._lock:
+            return self.store.first_date(field)
+    
+    def close(self):
+        """全てのリスナーを止める"""
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
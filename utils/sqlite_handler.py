@@ -0,0 +1,216 @@
+import sqlite3
+import threading
+import json
+import os
+from datetime import datetime, timezone
+import pandas as pd
+from utils.storage import HealthStorage, QueryCache
+
+
+class SQLiteHandler(HealthStorage):
+    """
+    ローカル SQLite ファイルに保存する実装
+    
+    1人で使う自前ホスティング向け。日付を主キーにしたテーブルに WAL モードで保存する。
+    path に ':memory:' を指定するとテスト・ベンチマーク用のインメモリ DB になる
+    """
+    
+    # 再実行やセッションをまたいで共有するキャッシュ
+    _cache = QueryCache()
+    
+    # 値の列の型
+    COLUMN_TYPES = {
+        'weight': 'REAL',
+        'went_to_gym': 'INTEGER',
+        'calories': 'INTEGER'
+    }
+    
+    def __init__(self, path='health.db', collection_names=None, user_id=None):
+        super().__init__(collection_names, user_id)
+        self.path = path
+        
+        # キャッシュは全インスタンスで共有するため、キーに DB を含めて別の DB と混ざらないようにする
+        # (インメモリ DB はインスタンスごとに別物)
+        if path == ':memory:':
+            self._cache_prefix = f':memory:{self._instance_id}'
+        else:
+            self._cache_prefix = os.path.abspath(path)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        
+        # インメモリ DB は接続ごとに別物になるため1つの接続を共有する
+        self._shared_conn = None
+        if path == ':memory:':
+            self._shared_conn = sqlite3.connect(path, check_same_thread=False)
+        
+        self._create_tables()
+    
+    def _conn(self):
+        """スレッドごとの接続 (WAL なので読み込みは並行できる)"""
+        if self._shared_conn is not None:
+            return self._shared_conn
+        
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+    
+    def _cache_name(self, collection):
+        return f'{self._cache_prefix}:{self.collection_names[collection]}'
+    
+    def _table(self, collection):
+        return '"{}"'.format(self.collection_names[collection].replace('"', '""'))
+    
+    def _create_tables(self):
+        with self._write_lock, self._conn() as conn:
+            for collection, field in self.DATA_FIELDS.items():
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {self._table(collection)} ('
+                    f'date TEXT PRIMARY KEY, {field} {self.COLUMN_TYPES[field]} NOT NULL, '
+                    f'updated_at TEXT NOT NULL) WITHOUT ROWID'
+                )
+            # 設定・サマリーは名前をキーにした JSON で保存
+            for collection in ('settings', 'summary'):
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS {self._table(collection)} ('
+                    f'name TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID'
+                )
+    
+    def _read_document(self, collection, name, conn=None):
+        row = (conn or self._conn()).execute(
+            f'SELECT data FROM {self._table(collection)} WHERE name = ?', (name,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def _write_document(self, conn, collection, name, data):
+        conn.execute(
+            f'INSERT OR REPLACE INTO {self._table(collection)} (name, data) VALUES (?, ?)',
+            (name, json.dumps(data, ensure_ascii=False))
+        )
+    
+    # ユーザー設定
+    def _read_settings(self):
+        return self._read_document('settings', 'user_config')
+    
+    def _write_settings(self, settings):
+        with self._write_lock, self._conn() as conn:
+            self._write_document(conn, 'settings', 'user_config', settings)
+    
+    # サマリー
+    def _read_summary(self, name):
+        return self._read_document('summary', name)
+    
+    def _write_summary(self, name, summary):
+        with self._write_lock, self._conn() as conn:
+            self._write_document(conn, 'summary', name, summary)
+    
+    # 日次データ
+    def _write_daily_record(self, date_str, record, update_summaries=None):
+        """
+        1日分の記録とサマリーを1つのトランザクションで保存
+        
+        BEGIN IMMEDIATE で書き込みロックを取ってからサマリーを読むため、
+        他のプロセスの保存とサマリーの更新が混ざらない
+        """
+        with self._write_lock, self._conn() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            summaries = {}
+            if update_summaries is not None:
+                summaries = update_summaries(
+                    lambda name: self._read_document('summary', name, conn)
+                )
+            self._insert_daily_record(conn, date_str, record)
+            for name, summary in summaries.items():
+                self._write_document(conn, 'summary', name, summary)
+        return summaries
+    
+    def _write_daily_records(self, records):
+        """複数日の記録を1つのトランザクションで保存"""
+        with self._write_lock, self._conn() as conn:
+            for date_str, record in records:
+                self._insert_daily_record(conn, date_str, record)
+    
+    def _insert_daily_record(self, conn, date_str, record):
+        updated_at = datetime.now(timezone.utc).isoformat()
+        for collection, field in self.DATA_FIELDS.items():
+            if field in record:
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {self._table(collection)} '
+                    f'(date, {field}, updated_at) VALUES (?, ?, ?)',
+                    (date_str, record[field], updated_at)
+                )
+    
+    def iter_collection_chunks(self, collection, field, start_date=None, end_date=None,
+                               chunk_size=500):
+        """
+        日付範囲の行を主キー順に読み込み、DataFrame のチャンクを順に返す
+        
+        Args:
+            collection: コレクション名
+            field: 値の列名
+            start_date: 開始日 (None の場合は最初から)
+            end_date: 終了日 (None の場合は最後まで)
+            chunk_size: 1回に取得する最大行数
+        
+        Yields:
+            date, 値の列を持つ日付順の DataFrame
+        """
+        sql = f'SELECT date, {field} FROM {self._table(collection)} WHERE 1 = 1'
+        params = []
+        if start_date:
+            sql += ' AND date >= ?'
+            params.append(start_date.strftime('%Y-%m-%d'))
+        if end_date:
+            sql += ' AND date <= ?'
+            params.append(end_date.strftime('%Y-%m-%d'))
+        sql += ' ORDER BY date'
+        
+        cursor = self._conn().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            
+            df = pd.DataFrame(rows, columns=['date', field])
+            df['date'] = pd.to_datetime(df['date'])
+            if field == 'went_to_gym':
+                df[field] = df[field].astype(bool)
+            yield df
+    
+    def _aggregate(self, collection, field, start_date, end_date, value):
+        """SQL の集計関数で件数・合計・平均を求める"""
+        sql = (f'SELECT COUNT({field}), SUM({field}), AVG({field}) '
+               f'FROM {self._table(collection)} WHERE 1 = 1')
+        params = []
+        if start_date:
+            sql += ' AND date >= ?'
+            params.append(start_date.strftime('%Y-%m-%d'))
+        if end_date:
+            sql += ' AND date <= ?'
+            params.append(end_date.strftime('%Y-%m-%d'))
+        if value is not None:
+            sql += f' AND {field} = ?'
+            params.append(value)
+        
+        count, total, average = self._conn().execute(sql, params).fetchone()
+        if field == 'went_to_gym':
+            total, average = 0, None
+        return {'count': count, 'sum': total or 0, 'avg': average}
+    
+    def _get_weight_before(self, date):
+        """指定日より前の最後の体重 (なければ None)"""
+        row = self._conn().execute(
+            f'SELECT weight FROM {self._table("weight")} WHERE date < ? '
+            f'ORDER BY date DESC LIMIT 1',
+            (date.strftime('%Y-%m-%d'),)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def _first_record_date(self, collection):
+        row = self._conn().execute(
+            f'SELECT MIN(date) FROM {self._table(collection)}'
+        ).fetchone()
+        return pd.Timestamp(row[0]) if row and row[0] else None
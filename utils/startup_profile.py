@@ -0,0 +1,119 @@
+"""
+起動時間の計測
+
+各モジュールを新しいプロセスで `python -X importtime` 付きで import し、
+読み込みにかかった時間 (累積) と、重いサブモジュールを表示する
+
+    python -m utils.startup_profile            # 既定のモジュール一覧
+    python -m utils.startup_profile plotly.graph_objects --top 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+# 起動時に読み込まれるモジュールと、ページ表示時まで遅延しているモジュール
+DEFAULT_MODULES = {
+    'startup': [
+        'streamlit',
+        'pandas',
+        'utils.storage',
+        'utils.auth',
+        'utils.firebase_handler'
+    ],
+    'lazy': [
+        'plotly.graph_objects',
+        'utils.chart',
+        'utils.ml_predictor',
+        'utils.recipe_searcher',
+        'googleapiclient.discovery'
+    ]
+}
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_import(module: str) -> List[Dict]:
+    """
+    新しいプロセスでモジュールを import し、-X importtime の結果を返す
+    
+    module に 'pass' を指定するとインタプリタ起動だけの結果になる
+    
+    Returns:
+        {'module', 'self_us', 'cumulative_us', 'depth'} のリスト (読み込み順)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'pass' if module == 'pass' else f'import {module}'],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'{module} の import に失敗しました:\n{result.stderr[-2000:]}')
+    
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        rows.append({
+            'module': name.strip(),
+            'self_us': int(self_us),
+            'cumulative_us': int(cumulative_us),
+            'depth': (len(name) - len(name.lstrip())) // 2
+        })
+    return rows
+
+
+def profile(modules: List[str], top: int = 3) -> List[Dict]:
+    """
+    モジュールごとの読み込み時間を計測
+    
+    Returns:
+        {'module', 'total_ms', 'heaviest'} のリスト
+        heaviest は自身の時間が大きいサブモジュール上位 top 件
+    """
+    # インタプリタ起動時に読み込まれるモジュールは除外する
+    baseline = {row['module'] for row in measure_import('pass')}
+    
+    report = []
+    for module in modules:
+        rows = [row for row in measure_import(module) if row['module'] not in baseline]
+        total = sum(row['cumulative_us'] for row in rows if row['depth'] == 0)
+        heaviest = sorted(rows, key=lambda row: row['self_us'], reverse=True)[:top]
+        report.append({
+            'module': module,
+            'total_ms': total / 1000,
+            'heaviest': [(row['module'], row['self_us'] / 1000) for row in heaviest]
+        })
+    return report
+
+
+def print_report(title: str, report: List[Dict]):
+    print(f'## {title}')
+    for entry in report:
+        print(f"{entry['module']:<32} {entry['total_ms']:>9.1f} ms")
+        for name, ms in entry['heaviest']:
+            print(f"    {name:<40} {ms:>7.1f} ms")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='モジュールの import 時間を計測')
+    parser.add_argument('modules', nargs='*', help='計測するモジュール (省略時は既定の一覧)')
+    parser.add_argument('--top', type=int, default=3, help='表示する重いサブモジュールの数')
+    args = parser.parse_args()
+    
+    if args.modules:
+        print_report('指定モジュール', profile(args.modules, args.top))
+        return
+    
+    print_report('起動時 (ログイン画面まで)', profile(DEFAULT_MODULES['startup'], args.top))
+    print_report('遅延読み込み (メイン画面で初めて読み込む)',
+                 profile(DEFAULT_MODULES['lazy'], args.top))
+
+
+if __name__ == '__main__':
+    main()
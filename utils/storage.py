@@ -0,0 +1,838 @@
+import streamlit as st
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import sys
+import threading
+import time
+import copy
+import re
+import uuid
+import pandas as pd
+import numpy as np
+from utils import perf
+from utils.daily_store import forward_fill
+from utils.gym_streak import (
+    apply_gym_record, compute_streak_summary, current_streak, empty_streak_summary
+)
+from utils.rolling_stats import (
+    RETENTION_DAYS, apply_daily_record, compute_rolling_summary, window_stats
+)
+from utils.weight_trend import (
+    TREND_VERSION, WeightTrend, apply_weight_record, compute_weight_trend
+)
+
+
+def _secrets_section(name):
+    """secrets のセクションを取得 (secrets.toml がない場合は空)"""
+    try:
+        return dict(st.secrets[name]) if name in st.secrets else {}
+    except FileNotFoundError:
+        return {}
+
+
+def create_storage(user_id=None, listen=None):
+    """
+    secrets の storage.backend に応じた保存先を作成
+    
+    backend = "sqlite" の場合は storage.path の SQLite ファイル、
+    それ以外は Firestore を使う
+    
+    Args:
+        user_id: ユーザー ID (指定すると users/{user_id}/ 以下のデータだけを読み書きする)
+        listen: Firestore のリスナーを使うか (None の場合は secrets の realtime.listen)
+    """
+    config = _secrets_section('storage')
+    if config.get('backend') == 'sqlite':
+        from utils.sqlite_handler import SQLiteHandler
+        return SQLiteHandler(config.get('path', 'health.db'), user_id=user_id)
+    
+    from utils.firebase_handler import FirebaseHandler
+    return FirebaseHandler(user_id=user_id, listen=listen)
+
+
+class QueryCache:
+    """
+    TTL と件数上限のあるキャッシュ (全セッションで共有)
+    
+    保存先のクエリ結果はキーの先頭をコレクション名にしてコレクション単位で破棄する。
+    アドバイス・予測のメモ (ml_predictor) にも使う
+    """
+    
+    def __init__(self, ttl=300, max_entries=128):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, collection):
+        """キーの先頭がコレクション名に一致するエントリを破棄"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == collection]:
+                del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'entries': len(self._entries)
+            }
+
+
+class _WriteBehindQueue:
+    """日付ごとに保存を集約し、バックグラウンドでリトライ付きコミットを行う"""
+    
+    # 終了時に未コミットの保存を待つ秒数
+    EXIT_FLUSH_TIMEOUT = 30
+    
+    def __init__(self, commit, max_retries=5, base_delay=0.5):
+        self._commit = commit
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        # リトライを使い切った後、次にまとめて再試行するまでの秒数
+        self.retry_interval = base_delay * (2 ** max_retries)
+        self.last_error = None
+        self.failed = False
+        self._pending = OrderedDict()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def submit(self, key, record):
+        """同じ日付の未コミット分があればフィールド単位で上書きして1回のコミットにまとめる"""
+        with self._cond:
+            if key in self._pending:
+                self._pending[key].update(record)
+            else:
+                self._pending[key] = dict(record)
+            if self._thread is None or not self._thread.is_alive():
+                if self._thread is None:
+                    atexit.register(self._flush_at_exit)
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, record = self._pending.popitem(last=False)
+                self._in_flight += 1
+            committed = self._commit_with_retry(key, record)
+            with self._cond:
+                self._in_flight -= 1
+                if committed:
+                    self.failed = False
+                else:
+                    # 失敗した記録は捨てずに先頭へ戻す (後から積まれた同じ日付の値を優先)
+                    record.update(self._pending.pop(key, {}))
+                    self._pending[key] = record
+                    self._pending.move_to_end(key, last=False)
+                    self.failed = True
+                self._cond.notify_all()
+            if not committed:
+                time.sleep(self.retry_interval)
+    
+    def _commit_with_retry(self, key, record):
+        """コミットできたら True (リトライを使い切ったら False)"""
+        for attempt in range(self.max_retries):
+            try:
+                self._commit(key, record)
+                self.last_error = None
+                return True
+            except Exception as e:
+                self.last_error = e
+                time.sleep(self.base_delay * (2 ** attempt))
+        return False
+    
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending) + self._in_flight
+    
+    def flush(self, timeout=None, stop_on_failure=True):
+        """
+        未コミットの保存がなくなるまで待つ
+        
+        Args:
+            timeout: 最大の待ち時間 (秒)
+            stop_on_failure: True の場合はリトライを使い切った時点で待つのをやめる
+        
+        Returns:
+            全てコミットできた場合は True
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: (not self._pending and not self._in_flight)
+                or (stop_on_failure and self.failed),
+                timeout
+            )
+            return not self._pending and not self._in_flight
+    
+    def _flush_at_exit(self):
+        # ワーカーはデーモンスレッドのため、終了前に未コミットの保存を書き込む
+        if not self.flush(self.EXIT_FLUSH_TIMEOUT, stop_on_failure=False):
+            print(f'未コミットの保存 {self.pending_count()} 件を書き込めませんでした: '
+                  f'{self.last_error}', file=sys.stderr)
+
+
+class HealthStorage:
+    """
+    健康データの保存先の共通処理
+    
+    サブクラスは保存先ごとの読み書き (_read_settings, _write_settings,
+    iter_collection_chunks, _get_weight_before, _first_record_date,
+    _write_daily_record, _write_daily_records, _read_summary, _write_summary)
+    を実装する
+    """
+    
+    # 再実行やセッションをまたいで共有するキャッシュ (サブクラスごとに持つ)
+    _cache = QueryCache()
+    
+    # 複数コレクションを並行して読み込むためのスレッドプール
+    _executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='storage-load')
+    
+    # 日次データのコレクションと値のフィールド
+    DATA_FIELDS = {
+        'weight': 'weight',
+        'gym': 'went_to_gym',
+        'calories': 'calories'
+    }
+    
+    # 論理名と保存先のコレクション (テーブル) 名
+    DEFAULT_COLLECTIONS = {
+        'weight': 'weight',
+        'gym': 'gym',
+        'calories': 'calories',
+        'settings': 'settings',
+        'summary': 'summary'
+    }
+    
+    # 1回のまとめた書き込みの最大件数 (Firestore の WriteBatch の上限)
+    MAX_BATCH_WRITES = 500
+    
+    # ユーザーごとのデータを置くルートコレクション
+    USERS_COLLECTION = 'users'
+    
+    # ユーザー ID に使える文字 (Firestore のパスとして安全なもの)
+    USER_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+    
+    # 初期パスワードも平文では保存せず、ソルト付きハッシュ (utils.auth.hash_password の形式) で置く
+    DEFAULT_SETTINGS = {
+        'password_hash': (
+            'pbkdf2_sha256$200000$111a73184cd4129c18dc918424d88b32$'
+            '9a9c2d3adf14a75e91106df91b59b1bebdd44562b782b063f6e5ef3c61db5d52'
+        ),
+        'calorie_goal': 2000,
+        'weight_goal': 70.0
+    }
+    
+    def __init__(self, collection_names=None, user_id=None):
+        self.user_id = user_id
+        # 空の ID でもルートのデータに繋がないよう、None 以外は全て検証する
+        names = self.user_collections(user_id) if user_id is not None else {}
+        names.update(collection_names or {})
+        self.collection_names = dict(self.DEFAULT_COLLECTIONS, **names)
+        self._writer = _WriteBehindQueue(self._commit_daily_record)
+        self._data_version = 0
+        self._instance_id = uuid.uuid4().hex
+    
+    @classmethod
+    def user_collections(cls, user_id):
+        """
+        ユーザーごとのコレクション名 (users/{user_id}/weight など)
+        
+        キャッシュのキーもこの名前で始まるため、ユーザー間でキャッシュが混ざらない
+        """
+        if not isinstance(user_id, str) or not cls.USER_ID_PATTERN.fullmatch(user_id):
+            raise ValueError("ユーザーIDは英数字・ハイフン・アンダースコア (64文字以内) で指定してください")
+        return {
+            name: f'{cls.USERS_COLLECTION}/{user_id}/{collection}'
+            for name, collection in cls.DEFAULT_COLLECTIONS.items()
+        }
+    
+    # 保存先ごとの実装
+    def _read_settings(self):
+        """ユーザー設定 (未作成なら None)"""
+        raise NotImplementedError
+    
+    def _write_settings(self, settings):
+        raise NotImplementedError
+    
+    def iter_collection_chunks(self, collection, field, start_date=None, end_date=None,
+                               chunk_size=500):
+        """日付範囲のデータを date, 値の列を持つ DataFrame のチャンクで順に返す"""
+        raise NotImplementedError
+    
+    def _get_weight_before(self, date):
+        """指定日より前の最後の体重 (なければ None)"""
+        raise NotImplementedError
+    
+    def _first_record_date(self, collection):
+        """最初の記録日 (なければ None)"""
+        raise NotImplementedError
+    
+    def _write_daily_record(self, date_str, record, update_summaries=None):
+        """
+        1日分の記録と更新したサマリーを1つのトランザクションで書き込む
+        
+        Args:
+            date_str: 記録日 ('YYYY-MM-DD')
+            record: フィールド名と値の辞書
+            update_summaries: サマリーを読む関数 (名前 -> ドキュメント) を受け取り、
+                              書き込むサマリーの辞書を返す関数。トランザクション内で呼ぶため、
+                              他の書き込みと競合した場合は読み直して呼び直してよい
+        
+        Returns:
+            書き込んだサマリーの辞書
+        """
+        raise NotImplementedError
+    
+    def _write_daily_records(self, records):
+        """
+        複数日の記録をまとめて書き込む (サマリーは更新しない)
+        
+        Args:
+            records: (記録日 'YYYY-MM-DD', フィールド名と値の辞書) のリスト
+                     (書き込み件数の合計は MAX_BATCH_WRITES 以下)
+        """
+        raise NotImplementedError
+    
+    def _read_summary(self, name):
+        """サマリードキュメント (未作成なら None)"""
+        raise NotImplementedError
+    
+    def _write_summary(self, name, summary):
+        raise NotImplementedError
+    
+    # キャッシュ
+    def _cache_name(self, collection):
+        return self.collection_names[collection]
+    
+    def _cached(self, key, loader):
+        value = self._cache.get(key)
+        if value is None:
+            # バックグラウンド保存中のデータを読み逃さないよう先に反映を待つ
+            self._writer.flush(timeout=10)
+            value = loader()
+            self._cache.set(key, value)
+        return value
+    
+    def _invalidate(self, collection):
+        self._cache.invalidate(self._cache_name(collection))
+        self._data_version += 1
+    
+    def data_version(self):
+        """データが変わるたびに増える番号 (このインスタンスでの書き込みと受け取った変更)"""
+        return self._data_version
+    
+    def data_key(self):
+        """
+        データの版を表すキー (計算結果のメモ化用)
+        
+        インスタンスごとの ID と data_version() の組なので、作り直したインスタンスや
+        他のユーザーの保存先と同じ値にならない
+        """
+        return (self._instance_id, self._data_version)
+    
+    def is_listening(self):
+        """他の端末からの書き込みをリスナーで受け取っているか"""
+        return False
+    
+    def cache_stats(self):
+        """キャッシュのヒット/ミス数"""
+        return self._cache.stats()
+    
+    def clear_cache(self):
+        self._cache.clear()
+    
+    @staticmethod
+    def _date_key(date):
+        return date.strftime('%Y-%m-%d') if date else None
+    
+    # ユーザー設定
+    def get_user_settings(self, create=True):
+        """
+        ユーザー設定を取得
+        
+        Args:
+            create: 未作成の場合にデフォルト設定を保存して返すか (False なら None を返す)
+        """
+        if not create:
+            return self._cached((self._cache_name('settings'),), self._read_settings)
+        return self._cached((self._cache_name('settings'),), self._load_user_settings)
+    
+    def _load_user_settings(self):
+        settings = self._read_settings()
+        if settings is not None:
+            return settings
+        else:
+            # デフォルト設定
+            default_settings = dict(self.DEFAULT_SETTINGS)
+            self._write_settings(default_settings)
+            return default_settings
+    
+    def update_user_settings(self, settings):
+        self._write_settings(settings)
+        self._invalidate('settings')
+    
+    def _query_collection(self, collection, field, start_date=None, end_date=None):
+        """コレクションを日付順に取得して DataFrame を返す"""
+        chunks = list(self.iter_collection_chunks(collection, field, start_date, end_date))
+        
+        if not chunks:
+            return pd.DataFrame(columns=['date', field])
+        
+        df = pd.concat(chunks, ignore_index=True)
+        return df.sort_values('date')
+    
+    # 日次データの一括保存
+    def save_daily_record(self, date, weight=None, went_to_gym=None, calories=None,
+                          background=False):
+        """
+        1日分の体重・ジム・カロリーを1回の書き込みでまとめて保存
+        
+        Args:
+            date: 記録日
+            weight: 体重 (None の場合は保存しない)
+            went_to_gym: ジムに行ったか (None の場合は保存しない)
+            calories: 消費カロリー (None の場合は保存しない)
+            background: True の場合は書き込みをキューに積んで即座に返す
+        """
+        date_str = date.strftime('%Y-%m-%d')
+        record = {
+            field: value
+            for field, value in (
+                ('weight', weight), ('went_to_gym', went_to_gym), ('calories', calories)
+            )
+            if value is not None
+        }
+        if not record:
+            return
+        
+        if background:
+            self._writer.submit(date_str, record)
+            # 次回の読み込みでキャッシュを使わず、コミット完了を待ってから取得させる
+            # (サマリーもコミット時に更新されるため、保存前の値を返さないよう破棄する)
+            for collection, field in self.DATA_FIELDS.items():
+                if field in record:
+                    self._invalidate(collection)
+            self._invalidate('summary')
+        else:
+            self._commit_daily_record(date_str, record)
+    
+    def _commit_daily_record(self, date_str, record):
+        # 連続記録・期間集計・体重トレンドのサマリーも同じトランザクションで差分更新
+        # (他の端末・プロセスと同時に保存しても、読んだサマリーを書き込み時点の値に揃える)
+        missing = set()
+        
+        def update_summaries(read_summary):
+            missing.clear()
+            summaries = {}
+            if 'went_to_gym' in record:
+                current = read_summary('gym_streak')
+                streak_summary = None
+                if current is not None:
+                    streak_summary = apply_gym_record(current, date_str, record['went_to_gym'])
+                if streak_summary is not None:
+                    summaries['gym_streak'] = streak_summary
+                else:
+                    missing.add('gym_streak')
+            
+            if 'weight' in record:
+                current = read_summary('weight_trend')
+                trend = None
+                if current is not None:
+                    trend = apply_weight_record(current, date_str, record['weight'])
+                if trend is not None:
+                    summaries['weight_trend'] = trend
+                else:
+                    missing.add('weight_trend')
+            
+            rolling = read_summary('rolling_stats')
+            if rolling is not None:
+                summaries['rolling_stats'] = apply_daily_record(rolling, date_str, record)
+            else:
+                missing.add('rolling_stats')
+            return summaries
+        
+        self._write_daily_record(date_str, record, update_summaries)
+        
+        for collection, field in self.DATA_FIELDS.items():
+            if field in record:
+                self._invalidate(collection)
+        
+        # サマリー未作成や過去日の修正は差分で扱えないため全体を再計算
+        if 'gym_streak' in missing:
+            self.recompute_gym_streak()
+        if 'rolling_stats' in missing:
+            self.recompute_rolling_stats()
+        if 'weight_trend' in missing:
+            self.recompute_weight_trend()
+        self._invalidate('summary')
+    
+    def save_daily_records(self, records):
+        """
+        過去日を含む複数日の記録を1回の書き込みで保存 (一括インポート用)
+        
+        サマリーは更新しないため、全て保存したら rebuild_summaries() を呼ぶ
+        
+        Args:
+            records: (記録日 'YYYY-MM-DD', フィールド名と値の辞書) のリスト
+        """
+        writes = sum(len(record) for _, record in records)
+        if writes > self.MAX_BATCH_WRITES:
+            raise ValueError(f'1回に書き込めるのは {self.MAX_BATCH_WRITES} 件までです ({writes} 件)')
+        if not writes:
+            return
+        
+        self._write_daily_records(records)
+        for collection in self.DATA_FIELDS:
+            self._invalidate(collection)
+    
+    def rebuild_summaries(self):
+        """記録全体から連続記録・期間集計・体重トレンドのサマリーを作り直す"""
+        self.recompute_gym_streak()
+        self.recompute_rolling_stats()
+        self.recompute_weight_trend()
+    
+    def pending_writes(self):
+        """バックグラウンドで未コミットの保存件数"""
+        return self._writer.pending_count()
+    
+    def write_error(self):
+        """
+        バックグラウンド保存がリトライを使い切った場合の最後のエラー (なければ None)
+        
+        失敗した記録はキューに残り、間隔を空けて再試行される
+        """
+        return self._writer.last_error if self._writer.failed else None
+    
+    def flush_writes(self, timeout=None):
+        """未コミットの保存を待ち、全てコミットできたら True"""
+        return self._writer.flush(timeout)
+    
+    # 体重データ
+    def save_weight(self, date, weight):
+        self._commit_daily_record(date.strftime('%Y-%m-%d'), {'weight': weight})
+    
+    def get_weight_data(self, start_date=None, end_date=None):
+        # 前方埋めは今日まで行うため日付もキーに含める
+        key = (self._cache_name('weight'), self._date_key(start_date), self._date_key(end_date),
+               datetime.now().date().isoformat())
+        return self._cached(key, lambda: self._load_weight_data(start_date, end_date))
+    
+    def _load_weight_data(self, start_date, end_date):
+        df = self._query_collection('weight', 'weight', start_date, end_date)
+        
+        # 期間の初日が未入力でも埋められるよう、期間直前の体重を起点にする
+        seed_weight = self._get_weight_before(start_date) if start_date else None
+        
+        if df.empty and seed_weight is None:
+            return df
+        
+        # 未入力日を前日の値で埋める
+        return self._fill_missing_dates(df, start_date, seed_weight)
+    
+    def _fill_missing_dates(self, df, start_date=None, seed_weight=None):
+        if df.empty and seed_weight is None:
+            return df
+        
+        # 起点の体重があれば期間の初日から今日までの日数分の配列に、日付の位置で値を置く
+        start = pd.Timestamp(start_date) if seed_weight is not None else df['date'].min()
+        start = start.normalize()
+        days = (pd.Timestamp(datetime.now().date()) - start).days + 1
+        weights = np.full(max(days, 0), np.nan)
+        if not df.empty:
+            positions = (df['date'].to_numpy() - start.to_datetime64()) // np.timedelta64(1, 'D')
+            inside = (positions >= 0) & (positions < len(weights))
+            weights[positions[inside]] = df['weight'].to_numpy(dtype=float)[inside]
+        if seed_weight is not None and len(weights) and np.isnan(weights[0]):
+            weights[0] = seed_weight
+        weights = forward_fill(weights)
+        
+        # 前方埋めしても値のない先頭の日は除く
+        filled = ~np.isnan(weights)
+        return pd.DataFrame({
+            'date': pd.date_range(start=start, periods=len(weights), freq='D')[filled],
+            'weight': weights[filled]
+        })
+    
+    def get_weight_history_days(self):
+        """最初の体重記録から今日までの日数 (前方埋め後の行数と同じ)"""
+        key = (self._cache_name('weight'), 'history_days', datetime.now().date().isoformat())
+        return self._cached(key, self._load_weight_history_days)
+    
+    def _load_weight_history_days(self):
+        first_date = self._first_record_date('weight')
+        
+        if first_date is None:
+            return 0
+        return max((pd.Timestamp(datetime.now().date()) - first_date).days + 1, 0)
+    
+    # ジムデータ
+    def save_gym_record(self, date, went_to_gym):
+        self._commit_daily_record(date.strftime('%Y-%m-%d'), {'went_to_gym': went_to_gym})
+    
+    def get_gym_data(self, start_date=None, end_date=None):
+        key = (self._cache_name('gym'), self._date_key(start_date), self._date_key(end_date))
+        return self._cached(
+            key, lambda: self._query_collection('gym', 'went_to_gym', start_date, end_date)
+        )
+    
+    # カロリーデータ
+    def save_calorie_record(self, date, calories):
+        self._commit_daily_record(date.strftime('%Y-%m-%d'), {'calories': calories})
+    
+    def get_calorie_data(self, start_date=None, end_date=None):
+        key = (self._cache_name('calories'), self._date_key(start_date), self._date_key(end_date))
+        return self._cached(
+            key, lambda: self._query_collection('calories', 'calories', start_date, end_date)
+        )
+    
+    # 並行読み込み
+    def load_all(self, start_date=None, end_date=None, include_settings=True):
+        """
+        体重・ジム・カロリー・設定を並行して取得
+        
+        Args:
+            start_date: 開始日 (None の場合は全期間)
+            end_date: 終了日 (None の場合は全期間)
+            include_settings: ユーザー設定も取得するか
+        
+        Returns:
+            'weight', 'gym', 'calories' (, 'settings') をキーとする辞書
+            各値は get_*_data() / get_user_settings() と同じ
+        """
+        loaders = {
+            'weight': lambda: self.get_weight_data(start_date, end_date),
+            'gym': lambda: self.get_gym_data(start_date, end_date),
+            'calories': lambda: self.get_calorie_data(start_date, end_date)
+        }
+        if include_settings:
+            loaders['settings'] = self.get_user_settings
+        
+        futures = {
+            name: perf.submit(self._executor, loader) for name, loader in loaders.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+    
+    # 日次データの統合
+    def get_daily_frame(self, start_date=None, end_date=None):
+        """
+        体重・ジム・カロリーを日付インデックスで結合した DataFrame を返す
+        
+        Args:
+            start_date: 開始日 (None の場合は全期間)
+            end_date: 終了日 (None の場合は今日まで)
+        
+        Returns:
+            DatetimeIndex の DataFrame (列: weight, went_to_gym, calories)
+            体重は前日の値で埋め済み、ジム・カロリーは未記録日が欠損値
+        """
+        return self.make_daily_frame(
+            self.load_all(start_date, end_date, include_settings=False), end_date
+        )
+    
+    @staticmethod
+    def make_daily_frame(data, end_date=None):
+        """load_all() の結果から日付インデックスの DataFrame を作成"""
+        weight_df, gym_df, calorie_df = data['weight'], data['gym'], data['calories']
+        
+        series = [
+            pd.Series(df[field].values, index=pd.DatetimeIndex(df['date']), name=field)
+            for df, field in (
+                (weight_df, 'weight'), (gym_df, 'went_to_gym'), (calorie_df, 'calories')
+            )
+        ]
+        frame = pd.concat(series, axis=1).sort_index()
+        frame.index.name = 'date'
+        
+        frame['weight'] = pd.to_numeric(frame['weight'], errors='coerce').astype(float)
+        frame['went_to_gym'] = frame['went_to_gym'].astype('boolean')
+        frame['calories'] = pd.to_numeric(frame['calories'], errors='coerce').astype(float)
+        
+        if end_date:
+            frame = frame.loc[:pd.Timestamp(end_date)]
+        return frame
+    
+    # 連続ジム日数
+    def get_gym_streak(self):
+        """連続記録サマリーを1回の読み込みで返す (未作成なら全体から作成)"""
+        summary = self._cached(
+            (self._cache_name('summary'), 'gym_streak'),
+            lambda: self._read_summary('gym_streak')
+        )
+        if summary is None:
+            summary = self.recompute_gym_streak()
+        return summary
+    
+    def recompute_gym_streak(self):
+        """ジム記録全体から連続記録サマリーを再計算して保存"""
+        gym_df = self._query_collection('gym', 'went_to_gym')
+        summary = compute_streak_summary(gym_df) if not gym_df.empty else empty_streak_summary()
+        self._write_summary('gym_streak', summary)
+        self._invalidate('summary')
+        return summary
+    
+    def calculate_consecutive_gym_days(self):
+        """今日まで続いているジムの連続日数"""
+        return current_streak(self.get_gym_streak())
+    
+    # 期間集計
+    def get_rolling_stats(self):
+        """直近の期間集計サマリーを1回の読み込みで返す (未作成なら記録から作成)"""
+        summary = self._cached(
+            (self._cache_name('summary'), 'rolling_stats'),
+            lambda: self._read_summary('rolling_stats')
+        )
+        if summary is None:
+            summary = self.recompute_rolling_stats()
+        return summary
+    
+    def recompute_rolling_stats(self):
+        """保持期間分の記録から期間集計サマリーを再計算して保存"""
+        today = datetime.now().date()
+        start_date = today - timedelta(days=RETENTION_DAYS - 1)
+        data = {
+            collection: self._query_collection(collection, field, start_date)
+            for collection, field in self.DATA_FIELDS.items()
+        }
+        summary = compute_rolling_summary(
+            self.make_daily_frame(data), self._get_weight_before(start_date), today
+        )
+        self._write_summary('rolling_stats', summary)
+        self._invalidate('summary')
+        return summary
+    
+    # 体重トレンド
+    def get_weight_trend(self):
+        """
+        保存済みの体重トレンド (WeightTrend) を1回の読み込みで返す (未作成なら記録から作成)
+        
+        体重の記録が何年分あっても、予測はこの十分統計量だけから計算できる
+        """
+        summary = self._cached(
+            (self._cache_name('summary'), 'weight_trend'),
+            lambda: self._read_summary('weight_trend')
+        )
+        if summary is None or summary.get('version') != TREND_VERSION:
+            summary = self.recompute_weight_trend()
+        return WeightTrend.from_dict(summary)
+    
+    def recompute_weight_trend(self):
+        """体重の記録全体からトレンドを再計算して保存"""
+        summary = compute_weight_trend(self._query_collection('weight', 'weight'))
+        self._write_summary('weight_trend', summary)
+        self._invalidate('summary')
+        return summary
+    
+    def get_window_stats(self, days):
+        """
+        今日までの days 日間の体重・ジム・カロリーの指標
+        
+        生データを読まずに期間集計サマリーだけから計算する
+        (戻り値は rolling_stats.window_stats() を参照)。
+        サマリーの保持期間より長い期間は、体重の指標を期間全体の体重の記録から、
+        ジム回数・平均消費カロリーを集計クエリで求める
+        """
+        stats = window_stats(self.get_rolling_stats(), days)
+        if days > RETENTION_DAYS:
+            start_date = datetime.now().date() - timedelta(days=days - 1)
+            stats.update(self._weight_window_stats(days, start_date))
+            stats['gym_count'] = self.count_gym_days(start_date)
+            stats['gym_rate'] = stats['gym_count'] / days
+            stats['avg_calories'] = self.average_calories(start_date) or 0
+        return stats
+    
+    def _weight_window_stats(self, days, start_date):
+        """保持期間より長い期間の体重の指標 (window_stats() と同じ計算を期間全体の記録で行う)"""
+        today = datetime.now().date()
+        key = (self._cache_name('weight'), 'window_stats', days, today.isoformat())
+        
+        def load():
+            weight_df = self._query_collection('weight', 'weight', start_date)
+            summary = {
+                'seed_weight': self._get_weight_before(start_date),
+                'days': {
+                    date.strftime('%Y-%m-%d'): {'weight': float(weight)}
+                    for date, weight in zip(pd.to_datetime(weight_df['date']), weight_df['weight'])
+                }
+            }
+            stats = window_stats(summary, days, today)
+            return {
+                name: stats[name]
+                for name in ('current_weight', 'weight_change', 'weight_trend', 'weight_slope')
+            }
+        
+        return self._cached(key, load)
+    
+    # 期間の集計
+    def aggregate(self, collection, start_date=None, end_date=None, value=None):
+        """
+        期間内の記録の件数・合計・平均
+        
+        Args:
+            collection: 'weight' / 'gym' / 'calories'
+            start_date: 開始日 (None の場合は最初から)
+            end_date: 終了日 (None の場合は最後まで)
+            value: 指定するとその値の記録だけを対象にする (ジムに行った日なら True)
+        
+        Returns:
+            count, sum, avg の辞書 (sum / avg は数値の項目のみ、記録がなければ 0 / None)
+        """
+        field = self.DATA_FIELDS[collection]
+        key = (self._cache_name(collection), 'aggregate', self._date_key(start_date),
+               self._date_key(end_date), value)
+        return self._cached(
+            key, lambda: self._aggregate(collection, field, start_date, end_date, value)
+        )
+    
+    def _aggregate(self, collection, field, start_date, end_date, value):
+        """記録を読み込んで集計 (集計クエリのない保存先用)"""
+        values = self._query_collection(collection, field, start_date, end_date)[field]
+        if value is not None:
+            values = values[values == value]
+        count = len(values)
+        if field == 'went_to_gym' or not count:
+            return {'count': count, 'sum': 0, 'avg': None}
+        
+        total = pd.to_numeric(values).sum().item()
+        return {'count': count, 'sum': total, 'avg': total / count}
+    
+    def count_gym_days(self, start_date=None, end_date=None):
+        """期間内にジムに行った日数"""
+        return self.aggregate('gym', start_date, end_date, value=True)['count']
+    
+    def average_calories(self, start_date=None, end_date=None):
+        """期間内の平均消費カロリー (記録がなければ None)"""
+        return self.aggregate('calories', start_date, end_date)['avg']
@@ -0,0 +1,522 @@
+"""
+記録の書き出し (エクスポート) と一括取り込み (インポート)
+
+    python -m utils.transfer export history.csv                 # 全期間を CSV に
+    python -m utils.transfer export history.parquet --start 2025-01-01
+    python -m utils.transfer import scale.csv --column 日付=date --column 体重=weight
+    python -m utils.transfer import history.csv --workers 8     # 中断しても同じコマンドで再開
+    python -m utils.transfer --user alice create-user           # ユーザーを作成 (パスワードを入力)
+
+書き出しはコレクションごとのカーソルページングを日付順にマージしながら1行ずつ書くため、
+期間の長さによらずメモリ使用量は一定。取り込みは MAX_BATCH_WRITES 件以下の
+まとめた書き込みに分け、同時に実行する書き込み数を制限してコミットする。
+完了した書き込みはチェックポイントファイルに記録し、再実行時は飛ばす。
+create-user は複数ユーザーの構成でログインできるよう、ユーザーの設定に
+パスワードハッシュを保存する (平文のパスワードは保存しない)
+"""
+import argparse
+import csv
+import getpass
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from utils.auth import invalidate_verifier, with_password
+from utils.storage import HealthStorage, create_storage
+
+# 書き出す列 (取り込みも同じ列名を使う)
+COLUMNS = ('date', 'weight', 'went_to_gym', 'calories')
+
+# 取り込む値の範囲 (データ入力画面と同じ。体重は 0 kg を含まない)
+WEIGHT_RANGE = (0.0, 300.0)
+CALORIES_RANGE = (0, 10000)
+
+# ジムの列で「行った」「行っていない」とみなす文字列
+_TRUE_VALUES = {'true', '1', 'yes', 'y', 'はい', '○', '◯'}
+_FALSE_VALUES = {'false', '0', 'no', 'n', 'いいえ', '×'}
+
+
+# 書き出し
+def _iter_values(storage, collection, field, start_date, end_date, chunk_size):
+    for chunk in storage.iter_collection_chunks(collection, field, start_date, end_date,
+                                                chunk_size):
+        for date, value in zip(chunk['date'], chunk[field].tolist()):
+            yield date, field, value
+
+
+def iter_daily_rows(storage: HealthStorage, start_date=None, end_date=None,
+                    chunk_size: int = 500) -> Iterator[Dict]:
+    """
+    全コレクションの記録を日付順に1日1行で返す
+    
+    Args:
+        storage: 保存先
+        start_date: 開始日 (None の場合は最初から)
+        end_date: 終了日 (None の場合は最後まで)
+        chunk_size: 1回のクエリで取得する最大件数
+    
+    Yields:
+        date ('YYYY-MM-DD'), weight, went_to_gym, calories の辞書 (記録なしは None)
+    """
+    streams = [
+        _iter_values(storage, collection, field, start_date, end_date, chunk_size)
+        for collection, field in storage.DATA_FIELDS.items()
+    ]
+    merged = heapq.merge(*streams, key=lambda item: item[0])
+    for date, items in itertools.groupby(merged, key=lambda item: item[0]):
+        row = dict.fromkeys(COLUMNS)
+        row['date'] = date.strftime('%Y-%m-%d')
+        for _, field, value in items:
+            row[field] = _normalize(field, value)
+        yield row
+
+
+def _normalize(field, value):
+    if field == 'went_to_gym':
+        return bool(value)
+    if field == 'calories':
+        return int(value)
+    return float(value)
+
+
+def export_csv(rows: Iterable[Dict], output) -> int:
+    """
+    行を CSV で書き出す
+    
+    Args:
+        rows: iter_daily_rows() の戻り値
+        output: 書き出すパス ('-' の場合は標準出力)
+    
+    Returns:
+        書き出した行数
+    """
+    f = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+    try:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def export_parquet(rows: Iterable[Dict], output, row_group_size: int = 10000) -> int:
+    """
+    行を Parquet で書き出す (row_group_size 行ずつ書くので全件をメモリに載せない)
+    
+    Returns:
+        書き出した行数
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Parquet で書き出すには pyarrow をインストールしてください')
+    
+    schema = pa.schema([
+        ('date', pa.string()),
+        ('weight', pa.float64()),
+        ('went_to_gym', pa.bool_()),
+        ('calories', pa.int64())
+    ])
+    count = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        while True:
+            group = list(itertools.islice(rows, row_group_size))
+            if not group:
+                break
+            writer.write_table(pa.Table.from_pylist(group, schema=schema))
+            count += len(group)
+    return count
+
+
+# 取り込み
+def _parse_gym(value):
+    if pd.isna(value):
+        return None
+    if isinstance(value, (bool, int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in _TRUE_VALUES:
+        return True
+    if text in _FALSE_VALUES:
+        return False
+    return None
+
+
+def _in_range(value, value_range, include_min=True):
+    if include_min:
+        return value_range[0] <= value <= value_range[1]
+    return value_range[0] < value <= value_range[1]
+
+
+def _read_chunks(path, chunk_size):
+    if path.lower().endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Parquet を読み込むには pyarrow をインストールしてください')
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+
+
+def iter_import_records(path: str, columns: Optional[Dict[str, str]] = None,
+                        chunk_size: int = 10000,
+                        stats: Optional[Dict] = None) -> Iterator[Tuple[str, Dict]]:
+    """
+    CSV / Parquet ファイルの行を1日分の記録に変換して順に返す
+    
+    日付の列 (date) と、weight / went_to_gym / calories の列のうちあるものを取り込む。
+    日付が読めない行と、範囲外・読めない値は飛ばす
+    
+    Args:
+        path: 取り込むファイル (.parquet 以外は CSV として読む)
+        columns: ファイルの列名と取り込む列名の対応 ({'体重': 'weight'} など)
+        chunk_size: 1回に読み込む行数
+        stats: 読み込んだ行数 (rows) と飛ばした値の数 (invalid) を加算する辞書
+    
+    Yields:
+        (記録日 'YYYY-MM-DD', フィールド名と値の辞書)
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('rows', 0)
+    stats.setdefault('invalid', 0)
+    
+    for chunk in _read_chunks(path, chunk_size):
+        chunk = chunk.rename(columns=columns or {})
+        if 'date' not in chunk.columns:
+            raise ValueError(f'{path} に日付の列 (date) がありません')
+        
+        # 列ごとにまとめて変換してから1行ずつ記録にする (列がなければ全て None)
+        empty = [None] * len(chunk)
+        dates = pd.to_datetime(chunk['date'], errors='coerce').tolist()
+        weights = (pd.to_numeric(chunk['weight'], errors='coerce').tolist()
+                   if 'weight' in chunk.columns else empty)
+        gyms = chunk['went_to_gym'].tolist() if 'went_to_gym' in chunk.columns else empty
+        calories = (pd.to_numeric(chunk['calories'], errors='coerce').tolist()
+                    if 'calories' in chunk.columns else empty)
+        
+        for date, weight, gym, calorie in zip(dates, weights, gyms, calories):
+            stats['rows'] += 1
+            if pd.isna(date):
+                stats['invalid'] += 1
+                continue
+            
+            record = {}
+            if not pd.isna(weight):
+                if _in_range(weight, WEIGHT_RANGE, include_min=False):
+                    record['weight'] = round(float(weight), 2)
+                else:
+                    stats['invalid'] += 1
+            went = _parse_gym(gym)
+            if went is not None:
+                record['went_to_gym'] = went
+            elif not pd.isna(gym) and str(gym).strip():
+                stats['invalid'] += 1
+            if not pd.isna(calorie):
+                if _in_range(calorie, CALORIES_RANGE):
+                    record['calories'] = int(round(calorie))
+                else:
+                    stats['invalid'] += 1
+            
+            if record:
+                yield date.strftime('%Y-%m-%d'), record
+
+
+class BulkImporter:
+    """
+    記録を MAX_BATCH_WRITES 件以下のまとめた書き込みに分けて並行してコミットする
+    
+    まとめ方は記録の並びと batch_size だけで決まるので、同じ入力なら何度実行しても
+    同じ番号の書き込みになる。完了した番号をチェックポイントファイルに記録し、
+    再実行時は飛ばす (全て完了したらファイルを削除する)
+    
+    Args:
+        storage: 保存先
+        max_workers: 同時に実行する書き込み数
+        batch_size: 1回の書き込みの最大件数 (None の場合は storage.MAX_BATCH_WRITES)
+        checkpoint_path: チェックポイントファイル (None の場合は再開しない)
+        source: 入力を表す値 (チェックポイントが同じ入力のものか確認する)
+        progress: 書き込みが完了するたびに集計の辞書を渡して呼ぶ関数
+        max_retries: 失敗した書き込みのリトライ回数
+        base_delay: リトライの待ち時間の初期値 (秒、毎回2倍)
+    """
+    
+    def __init__(self, storage: HealthStorage, max_workers: int = 4,
+                 batch_size: Optional[int] = None, checkpoint_path: Optional[str] = None,
+                 source=None, progress: Optional[Callable[[Dict], None]] = None,
+                 max_retries: int = 5, base_delay: float = 0.5):
+        self.storage = storage
+        self.max_workers = max_workers
+        self.batch_size = min(batch_size or storage.MAX_BATCH_WRITES, storage.MAX_BATCH_WRITES)
+        self.checkpoint_path = checkpoint_path
+        self.source = source
+        self.progress = progress
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.stats = {'batches': 0, 'records': 0, 'writes': 0, 'skipped_batches': 0}
+        self._done = set()
+        self._lock = threading.Lock()
+    
+    def _iter_batches(self, records):
+        """(番号, 記録のリスト, 書き込み件数) を返す (同じ日付は1つの記録にまとめる)"""
+        batch = {}
+        writes = 0
+        index = 0
+        for date_str, record in records:
+            added = len(record) - len(batch.get(date_str, {}).keys() & record.keys())
+            if writes + added > self.batch_size and batch:
+                yield index, list(batch.items()), writes
+                index += 1
+                batch = {}
+                writes = 0
+                added = len(record)
+            batch.setdefault(date_str, {}).update(record)
+            writes += added
+        if batch:
+            yield index, list(batch.items()), writes
+    
+    def _commit_with_retry(self, records):
+        for attempt in range(self.max_retries):
+            try:
+                self.storage.save_daily_records(records)
+                return
+            except Exception:
+                if attempt == self.max_retries - 1:
+                    raise
+                time.sleep(self.base_delay * (2 ** attempt))
+    
+    # チェックポイント
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('batch_size') != self.batch_size or checkpoint.get('source') != self.source:
+            raise ValueError(
+                f'{self.checkpoint_path} は別の入力または batch_size のチェックポイントです'
+            )
+        return set(checkpoint['done'])
+    
+    def _save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        checkpoint = {
+            'batch_size': self.batch_size,
+            'source': self.source,
+            'done': sorted(self._done),
+            'updated': datetime.now().isoformat(timespec='seconds')
+        }
+        # 書き込み途中のファイルを読まないよう一時ファイル経由で置き換える
+        with open(self.checkpoint_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+    
+    def _completed(self, index, records, writes):
+        with self._lock:
+            self._done.add(index)
+            self.stats['batches'] += 1
+            self.stats['records'] += len(records)
+            self.stats['writes'] += writes
+            self._save_checkpoint()
+            stats = dict(self.stats)
+        if self.progress:
+            self.progress(stats)
+    
+    def run(self, records: Iterable[Tuple[str, Dict]]) -> Dict:
+        """
+        記録を全て書き込み、最後にサマリーを作り直す
+        
+        書き込みが失敗した場合は実行中の書き込みの完了を待ってから例外を送出する
+        (完了した分はチェックポイントに残る)
+        
+        Args:
+            records: (記録日 'YYYY-MM-DD', フィールド名と値の辞書) の反復可能オブジェクト
+        
+        Returns:
+            書き込んだ件数などの集計
+        """
+        self._done = self._load_checkpoint()
+        in_flight = {}
+        error = None
+        
+        def collect(futures):
+            nonlocal error
+            for future in futures:
+                index, batch, writes = in_flight.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    self._completed(index, batch, writes)
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix='bulk-import') as executor:
+            for index, batch, writes in self._iter_batches(records):
+                if index in self._done:
+                    self.stats['skipped_batches'] += 1
+                    continue
+                # 実行中の書き込みが上限に達したら1つ終わるまで待つ (入力も先読みしない)
+                while len(in_flight) >= self.max_workers:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                if error is not None:
+                    break
+                in_flight[executor.submit(self._commit_with_retry, batch)] = (index, batch, writes)
+            collect(wait(in_flight).done)
+        
+        if error is not None:
+            raise error
+        
+        if self.stats['batches']:
+            self.storage.rebuild_summaries()
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return dict(self.stats)
+
+
+# コマンドライン
+def _date(text):
+    return datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def _column(text):
+    source, _, target = text.partition('=')
+    if not source or target not in COLUMNS:
+        raise argparse.ArgumentTypeError(
+            f"'{text}' は 元の列名={'/'.join(COLUMNS)} の形式で指定してください"
+        )
+    return source, target
+
+
+def _export(args):
+    # コマンドラインではリスナーを使わない (secrets の realtime.listen によらず)
+    storage = create_storage(args.user, listen=False)
+    rows = iter_daily_rows(storage, args.start, args.end, args.chunk_size)
+    if args.output.lower().endswith('.parquet'):
+        count = export_parquet(rows, args.output)
+    else:
+        count = export_csv(rows, args.output)
+    print(f'{count} 日分を書き出しました', file=sys.stderr)
+
+
+def _import(args):
+    read_stats = {}
+    records = iter_import_records(args.input, dict(args.column or []), stats=read_stats)
+    
+    if args.dry_run:
+        days = sum(1 for _ in records)
+        print(f"{read_stats['rows']} 行中 {days} 日分を取り込めます "
+              f"(飛ばす値 {read_stats['invalid']} 件)", file=sys.stderr)
+        return
+    
+    def progress(stats):
+        print(f"\r{stats['batches']} 回 / {stats['records']} 日分 / "
+              f"{stats['writes']} 件を書き込みました (読み込み {read_stats['rows']} 行)",
+              end='', file=sys.stderr, flush=True)
+    
+    stat = os.stat(args.input)
+    importer = BulkImporter(
+        create_storage(args.user, listen=False),
+        max_workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_path=args.checkpoint or args.input + '.checkpoint.json',
+        source={'path': os.path.abspath(args.input), 'size': stat.st_size,
+                'mtime': int(stat.st_mtime),
+                'columns': [list(column) for column in sorted(args.column or [])]},
+        progress=progress
+    )
+    stats = importer.run(records)
+    print(file=sys.stderr)
+    if stats['skipped_batches']:
+        print(f"前回完了した {stats['skipped_batches']} 回分を飛ばしました", file=sys.stderr)
+    print(f"{stats['records']} 日分 ({stats['writes']} 件) を取り込みました "
+          f"(飛ばした値 {read_stats['invalid']} 件)", file=sys.stderr)
+
+
+def _read_password(args):
+    if args.password_stdin:
+        return sys.stdin.readline().rstrip('\n')
+    password = getpass.getpass('パスワード: ')
+    if password != getpass.getpass('パスワード (確認): '):
+        raise SystemExit('パスワードが一致しません')
+    return password
+
+
+def _create_user(args):
+    try:
+        storage = create_storage(args.user, listen=False)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    
+    settings = storage.get_user_settings(create=False)
+    if settings is not None and not args.reset_password:
+        raise SystemExit('ユーザーは作成済みです (パスワードを変える場合は --reset-password)')
+    
+    password = _read_password(args)
+    if not password:
+        raise SystemExit('パスワードを入力してください')
+    
+    created = settings is None
+    if created:
+        settings = {key: value for key, value in HealthStorage.DEFAULT_SETTINGS.items()
+                    if key != 'password_hash'}
+    storage.update_user_settings(with_password(settings, password))
+    invalidate_verifier(args.user)
+    print('ユーザーを作成しました' if created else 'パスワードを変更しました', file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='記録の書き出しと一括取り込み')
+    parser.add_argument('--user', help='ユーザー ID (複数ユーザーで使う場合)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    export = commands.add_parser('export', help='全期間の記録を CSV / Parquet に書き出す')
+    export.add_argument('output', help='書き出すパス (.parquet なら Parquet、- で標準出力)')
+    export.add_argument('--start', type=_date, help='開始日 (YYYY-MM-DD)')
+    export.add_argument('--end', type=_date, help='終了日 (YYYY-MM-DD)')
+    export.add_argument('--chunk-size', type=int, default=500,
+                        help='1回のクエリで取得する件数')
+    export.set_defaults(func=_export)
+    
+    imports = commands.add_parser('import', help='CSV / Parquet の記録を取り込む')
+    imports.add_argument('input', help='取り込むファイル')
+    imports.add_argument('--column', type=_column, action='append',
+                         help='列名の対応 (例: --column 体重=weight、複数指定可)')
+    imports.add_argument('--workers', type=int, default=4, help='同時に実行する書き込み数')
+    imports.add_argument('--batch-size', type=int,
+                         help='1回の書き込みの最大件数 (既定・上限は 500)')
+    imports.add_argument('--checkpoint',
+                         help='チェックポイントファイル (既定は 入力ファイル.checkpoint.json)')
+    imports.add_argument('--dry-run', action='store_true',
+                         help='書き込まずに取り込める件数だけを表示')
+    imports.set_defaults(func=_import)
+    
+    create_user = commands.add_parser(
+        'create-user', help='--user のユーザーを作成 (パスワードハッシュを保存)'
+    )
+    create_user.add_argument('--password-stdin', action='store_true',
+                             help='パスワードを標準入力の1行目から読む (スクリプト用)')
+    create_user.add_argument('--reset-password', action='store_true',
+                             help='作成済みのユーザーのパスワードを変更する')
+    create_user.set_defaults(func=_create_user)
+    
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+from collections import deque
+
+# 保存するサマリーの形式 (記録のない日を前日の体重で埋めて回帰するようにしたため 2)。
+# 古い形式のサマリーは差分更新せず、記録全体から作り直す
+TREND_VERSION = 2
+
+
+class WeightTrend:
+    """
+    体重の線形トレンドを逐次更新する推定器
+    
+    重み付き最小二乗の十分統計量 (Σw, Σwx, Σwy, Σwxy, Σwx²) だけを保持し、
+    1件の追加を O(1) で反映する。x は origin からの日数。
+    
+    Args:
+        window: 直近何日分を使うか (None の場合は全期間)
+        decay: 1日あたりの重みの減衰率 (1.0 で減衰なし、0.97 なら約23日で半分)
+    """
+    
+    def __init__(self, window=None, decay=1.0):
+        if not 0 < decay <= 1:
+            raise ValueError("decay は 0 より大きく 1 以下で指定してください")
+        self.window = window
+        self.decay = decay
+        self.origin = None
+        self.last_x = None
+        self.last_y = None
+        self.sums = np.zeros(5)
+        self._points = deque()
+    
+    def _to_x(self, date):
+        return (pd.Timestamp(date) - self.origin).days
+    
+    @staticmethod
+    def _terms(x, y, w=1.0):
+        return np.array([w, w * x, w * y, w * x * y, w * x * x])
+    
+    def update(self, date, weight):
+        """1日分の体重を追加 (日付の古い順に追加すること)"""
+        if self.origin is None:
+            self.origin = pd.Timestamp(date).normalize()
+        x = self._to_x(date)
+        
+        if self.last_x is not None:
+            if x < self.last_x:
+                raise ValueError("体重は日付の古い順に追加してください")
+            # 経過日数ぶん既存の点の重みを減衰させる
+            if self.decay < 1 and x > self.last_x:
+                self.sums *= self.decay ** (x - self.last_x)
+        self.last_x = x
+        self.last_y = float(weight)
+        
+        self.sums += self._terms(x, weight)
+        
+        if self.window:
+            self._points.append((x, weight))
+            while self._points[0][0] <= x - self.window:
+                old_x, old_y = self._points.popleft()
+                self.sums -= self._terms(old_x, old_y, self.decay ** (x - old_x))
+    
+    def fill_to(self, date):
+        """
+        最後の記録日の翌日から date までを最後の体重で埋める
+        
+        未入力日を前日の値で埋めた日次の体重 (get_weight_data()) と同じ点で回帰するために使う
+        """
+        if self.origin is None:
+            return
+        end = self._to_x(date)
+        if end <= self.last_x:
+            return
+        
+        x = np.arange(self.last_x + 1, end + 1)
+        if self.window:
+            x = x[x > end - self.window]
+        if self.decay < 1:
+            self.sums *= self.decay ** (end - self.last_x)
+        w = self.decay ** (end - x)
+        self.sums += np.array([
+            w.sum(), (w * x).sum(), self.last_y * w.sum(), self.last_y * (w * x).sum(),
+            (w * x * x).sum()
+        ])
+        self.last_x = end
+        
+        if self.window:
+            self._points.extend((int(day), self.last_y) for day in x)
+            while self._points[0][0] <= end - self.window:
+                old_x, old_y = self._points.popleft()
+                self.sums -= self._terms(old_x, old_y, self.decay ** (end - old_x))
+    
+    def remove(self, date, weight):
+        """追加済みの記録を取り除く (過去日の修正用)"""
+        x = self._to_x(date)
+        self.sums -= self._terms(x, weight, self.decay ** (self.last_x - x))
+        if self.window and (x, weight) in self._points:
+            self._points.remove((x, weight))
+    
+    def coefficients(self):
+        """(傾き [kg/日], 切片) を返す"""
+        w, wx, wy, wxy, wxx = self.sums
+        if w <= 0:
+            return 0.0, float('nan')
+        
+        denominator = w * wxx - wx * wx
+        if abs(denominator) < 1e-12 * max(w * wxx, 1.0):
+            # 1日分しかない場合は水平線
+            return 0.0, wy / w
+        
+        slope = (w * wxy - wx * wy) / denominator
+        intercept = (wy - slope * wx) / w
+        return slope, intercept
+    
+    def predict(self, date):
+        slope, intercept = self.coefficients()
+        return intercept + slope * self._to_x(date)
+    
+    def predict_days_ahead(self, days):
+        """最後の記録日 (fill_to() で埋めた場合はその日) の翌日から days 日分の予測値"""
+        slope, intercept = self.coefficients()
+        future_x = self.last_x + np.arange(1, days + 1)
+        return intercept + slope * future_x
+    
+    @classmethod
+    def from_series(cls, dates, weights, window=None, decay=1.0):
+        """
+        日付順の体重からまとめて作成 (update() を順に呼んだ場合と同じ状態になる)
+        
+        Args:
+            dates: 日付の配列
+            weights: 体重の配列
+            window: 直近何日分を使うか
+            decay: 1日あたりの重みの減衰率
+        """
+        trend = cls(window=window, decay=decay)
+        dates = pd.DatetimeIndex(dates)
+        y = np.asarray(weights, dtype=float)
+        if len(dates) == 0:
+            return trend
+        
+        trend.origin = dates[0].normalize()
+        x = (dates - trend.origin).days.to_numpy()
+        trend.last_x = int(x[-1])
+        trend.last_y = float(y[-1])
+        
+        if window:
+            in_window = x > trend.last_x - window
+            x, y = x[in_window], y[in_window]
+            trend._points = deque(zip(x.tolist(), y.tolist()))
+        
+        w = decay ** (trend.last_x - x)
+        trend.sums = np.array([
+            w.sum(), (w * x).sum(), (w * y).sum(), (w * x * y).sum(), (w * x * x).sum()
+        ])
+        return trend
+    
+    def to_dict(self):
+        """Firestore などに保存できる形に変換 (Firestore は配列の入れ子を保存できないため点は辞書にする)"""
+        return {
+            'version': TREND_VERSION,
+            'window': self.window,
+            'decay': self.decay,
+            'origin': self.origin.strftime('%Y-%m-%d') if self.origin is not None else None,
+            'last_x': self.last_x,
+            'last_y': self.last_y,
+            'sums': self.sums.tolist(),
+            'points': [{'x': int(x), 'y': float(y)} for x, y in self._points]
+        }
+    
+    @classmethod
+    def from_dict(cls, data):
+        trend = cls(window=data.get('window'), decay=data.get('decay', 1.0))
+        trend.origin = pd.Timestamp(data['origin']) if data.get('origin') else None
+        trend.last_x = data.get('last_x')
+        trend.last_y = data.get('last_y')
+        trend.sums = np.array(data.get('sums', [0.0] * 5), dtype=float)
+        trend._points = deque((point['x'], point['y']) for point in data.get('points', []))
+        return trend
+
+
+def compute_weight_trend(weight_df):
+    """
+    体重の記録全体からトレンドのサマリー (WeightTrend.to_dict() の形) を計算 (修復・バックフィル用)
+    
+    記録のない日は前日の体重で埋めて回帰する (最後の記録日まで)
+    
+    Args:
+        weight_df: date, weight 列を持つ日付順の DataFrame
+    """
+    if weight_df.empty:
+        return WeightTrend().to_dict()
+    daily = weight_df.set_index(pd.DatetimeIndex(weight_df['date']))['weight'].astype(float)
+    daily = daily[~daily.index.duplicated(keep='last')].asfreq('D').ffill()
+    return WeightTrend.from_series(daily.index, daily.to_numpy()).to_dict()
+
+
+def apply_weight_record(summary, date_str, weight):
+    """
+    1件の体重記録をトレンドのサマリーに反映 (O(1))
+    
+    最後の記録日以降への追記と最後の記録日の上書きだけを差分更新し、
+    それより前の日付の修正など差分では扱えない場合は None を返す (全体再計算が必要)。
+    間の空いた日は compute_weight_trend() と同じく前日の体重で埋める
+    
+    Args:
+        summary: WeightTrend.to_dict() の形のサマリー
+        date_str: 記録日 ('YYYY-MM-DD')
+        weight: 体重
+    """
+    if summary.get('version') != TREND_VERSION:
+        return None
+    trend = WeightTrend.from_dict(summary)
+    if trend.origin is not None:
+        x = trend._to_x(date_str)
+        if x < trend.last_x:
+            return None
+        if x == trend.last_x:
+            if trend.last_y is None:
+                return None
+            trend.remove(date_str, trend.last_y)
+        else:
+            trend.fill_to(pd.Timestamp(date_str) - pd.Timedelta(days=1))
+    trend.update(date_str, weight)
+    return trend.to_dict()